@@ -0,0 +1,105 @@
+#!/local/anaconda/bin/python
+# IMPORTANT: leave the above line as is.
+
+import argparse
+import os
+import sys
+
+from mapper  import encode_signature
+from reducer import SIGNATURE_KEY, VALUE_SEPARATOR, decode_signature, prepare
+
+# Set to 1 by tools/mapreduce.py when the combiner sees a merged partition.
+PARTITION_VARIABLE = 'mapreduce_combine_partition'
+
+#--------------------------------------------------------------------------
+# COMBINING
+#
+# The combiner sees the sorted output of a single mapper. It merges all
+# values of a bucket into one record and drops videos repeated within a
+# bucket. Singleton buckets cannot be dropped here, since other mappers
+# may add videos to the same bucket.
+#
+# With --partition, or when tools/mapreduce.py runs the combiner over a
+# whole merged partition, every bucket is complete, and buckets left with
+# a single video are dropped, as they cannot yield a pair.
+#
+# With --compact, text records are rewritten to the compact format of the
+# mapper: the signature of every video is emitted once and the buckets
+# only refer to the video ids. Like the compact mapper format, this needs
+# all records to reach a single reducer.
+
+def combine(key, values, compact, emitted, partition=False):
+    """
+    Combines all values of a key into a single record.
+
+    @param key:       The key of the values.
+    @param values:    The values of the key.
+    @param compact:   True if text records are to be rewritten as compact.
+    @param emitted:   The set of videos whose signature has been emitted.
+    @param partition: True if the values are all values of the key, so a
+                      bucket with a single video can be dropped.
+
+    @return: The combined records.
+    """
+    if key.startswith(SIGNATURE_KEY):
+        return ["%s, %s\n" % (key, values[0])]
+
+    prepared = {}
+    for value in values:
+        vid, sigstr = prepare(value)
+        if vid not in prepared:
+            prepared[vid] = (value, sigstr)
+
+    if partition and len(prepared) < 2:
+        return []
+
+    records = []
+    videos  = {}
+    for vid, (value, sigstr) in prepared.iteritems():
+        if compact and sigstr is not None:
+            if vid not in emitted:
+                emitted.add(vid)
+                signature = encode_signature(decode_signature(sigstr))
+                records.append(SIGNATURE_KEY + "%d), %s\n" % (vid, signature))
+            value = str(vid)
+
+        videos[vid] = value
+
+    records.append("%s, %s\n" % (key, VALUE_SEPARATOR.join(videos.values())))
+
+    return records
+
+#--------------------------------------------------------------------------
+# MAIN
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="LSH combiner")
+    parser.add_argument('--compact', action='store_true',
+                        help="rewrite text records in compact format")
+    parser.add_argument('--partition', action='store_true',
+                        default=os.environ.get(PARTITION_VARIABLE) == '1',
+                        help="the input is a whole partition: drop buckets "
+                             "with a single video")
+    args = parser.parse_args()
+
+    last_key = None
+    values   = []
+    emitted  = set()
+
+    for line in sys.stdin:
+        line = line.strip()
+        if not line:
+            continue
+
+        key, value = line.split(", ")
+        if key != last_key and last_key is not None:
+            sys.stdout.write(''.join(combine(last_key, values, args.compact, emitted,
+                                             args.partition)))
+            values = []
+
+        last_key = key
+        values.extend(value.split(VALUE_SEPARATOR))
+
+    if last_key is not None:
+        sys.stdout.write(''.join(combine(last_key, values, args.compact, emitted,
+                                             args.partition)))
@@ -0,0 +1,266 @@
+#!/local/anaconda/bin/python
+# IMPORTANT: leave the above line as is.
+
+import json
+import numpy as np
+import os
+
+from mapper import BANDS, ROWS, HASHES, BAND_BUCKETS
+from mapper import produce_signature, hash_bands, parameters
+
+#--------------------------------------------------------------------------
+# CONSTANTS
+
+SIMILAIRTY_THRESHOLD = 0.9
+MERGE_SIZE           = 1 << 16
+CACHE_SIZE           = 1024     # Videos whose signature and keys are kept.
+BAND_OFFSETS         = np.arange(BANDS, dtype=np.int64)*BAND_BUCKETS
+
+#--------------------------------------------------------------------------
+# INDEX
+
+def band_keys(signature):
+    """
+    Returns the bucket keys of a signature. Every band has its own range
+    of BAND_BUCKETS keys, so all bands share a single integer table.
+
+    @param signature: The signature to compute the keys for.
+
+    @return: The keys of the buckets of all bands.
+    """
+    return BAND_OFFSETS + hash_bands(signature[np.newaxis, :])[0]
+
+class LSHIndex(object):
+    """
+    An in-process LSH index using the hash functions of the mapper.
+
+    The buckets are stored as a sorted array of keys with a parallel array
+    of video rows, which is looked up by binary search. New videos go to a
+    small delta table mapping keys to rows, which is merged into the sorted
+    table once it holds MERGE_SIZE keys. Snapshots are plain .npy files
+    that are memory mapped when loaded.
+
+    Computing a signature costs far more than looking up its keys, so the
+    signatures and keys of the last CACHE_SIZE videos inserted or queried
+    are cached by their shingles. A video that is queried and then
+    inserted, or queried again, is only hashed once. Callers which already
+    have a signature can look it up with query_signature.
+    """
+
+    def __init__(self):
+        self.count      = 0
+        self.vids       = np.zeros(0, dtype=np.int64)
+        self.signatures = np.zeros((0, HASHES), dtype='<u2')
+
+        self.keys       = np.zeros(0, dtype=np.int64)
+        self.rows       = np.zeros(0, dtype=np.int64)
+        self.delta      = {}
+        self.delta_size = 0
+        self.cache      = {}
+
+    def __len__(self):
+        return self.count
+
+    @staticmethod
+    def grow(array, size):
+        """
+        Returns a writable copy of the array with room for at least the
+        specified number of rows, doubling the capacity if needed.
+        """
+        if len(array) >= size and array.flags.writeable:
+            return array
+
+        grown = np.zeros((max(size, 2*len(array)),) + array.shape[1:],
+                         dtype=array.dtype)
+        grown[:len(array)] = array
+
+        return grown
+
+    def signature(self, shingles):
+        """
+        Returns the signature and the bucket keys of a video, from the cache
+        if the same shingles were seen recently.
+
+        @param shingles: The shingles of the video.
+
+        @return: A (signature, keys) tuple.
+        """
+        shingles = np.asarray(shingles, dtype=int)
+        name     = shingles.tostring()
+        if name in self.cache:
+            return self.cache[name]
+
+        if len(self.cache) >= CACHE_SIZE:
+            self.cache.clear()
+
+        signature = produce_signature(shingles)
+        entry     = (signature, band_keys(signature))
+        self.cache[name] = entry
+
+        return entry
+
+    def insert(self, vid, shingles):
+        """
+        Inserts a video into the index.
+
+        @param vid:      The id of the video.
+        @param shingles: The shingles of the video.
+        """
+        signature, keys = self.signature(shingles)
+
+        self.vids       = self.grow(self.vids,       self.count + 1)
+        self.signatures = self.grow(self.signatures, self.count + 1)
+        self.vids[self.count]       = vid
+        self.signatures[self.count] = signature
+
+        for key in keys.tolist():
+            self.delta.setdefault(key, []).append(self.count)
+
+        self.count      += 1
+        self.delta_size += BANDS
+
+        if self.delta_size >= MERGE_SIZE:
+            self.merge()
+
+    def merge(self):
+        """
+        Merges the delta table into the sorted table. Only the delta is
+        sorted, its keys are inserted into the sorted table at the
+        positions found by binary search, which takes time linear in the
+        size of the table.
+        """
+        if self.delta_size == 0:
+            return
+
+        delta_keys = np.array([key for key, rows in self.delta.iteritems()
+                               for row in rows], dtype=np.int64)
+        delta_rows = np.array([row for key, rows in self.delta.iteritems()
+                               for row in rows], dtype=np.int64)
+
+        # The rows of a key are ascending and later than all rows in the
+        # table, so a stable sort and inserting to the right keep every
+        # bucket ordered by row.
+        order      = np.argsort(delta_keys, kind='mergesort')
+        delta_keys = delta_keys[order]
+        delta_rows = delta_rows[order]
+        positions  = np.searchsorted(self.keys, delta_keys, side='right')
+
+        self.keys       = np.insert(self.keys, positions, delta_keys)
+        self.rows       = np.insert(self.rows, positions, delta_rows)
+        self.delta      = {}
+        self.delta_size = 0
+
+    def lookup(self, keys):
+        """
+        Returns the rows of all videos in the buckets of the keys.
+
+        @param keys: The bucket keys, as returned by band_keys.
+        """
+        lower = np.searchsorted(self.keys, keys, side='left')
+        upper = np.searchsorted(self.keys, keys, side='right')
+
+        found = [self.rows[l:u] for (l, u) in zip(lower, upper) if u > l]
+        if self.delta:
+            for key in keys.tolist():
+                if key in self.delta:
+                    found.append(np.array(self.delta[key], dtype=np.int64))
+
+        if len(found) == 0:
+            return np.zeros(0, dtype=np.int64)
+
+        return np.unique(np.concatenate(found))
+
+    def candidate_rows(self, signature):
+        """
+        Returns the rows of all videos sharing a bucket with the signature.
+        """
+        return self.lookup(band_keys(signature))
+
+    def query_signature(self, signature):
+        """
+        Returns the candidates for near duplicates of a video signature.
+
+        @param signature: The signature of the video.
+
+        @return: The ids of all videos sharing a bucket with the video.
+        """
+        return np.unique(self.vids[self.candidate_rows(signature)])
+
+    def query(self, shingles):
+        """
+        Returns the candidates for near duplicates of a video.
+
+        @param shingles: The shingles of the video.
+
+        @return: The ids of all videos sharing a bucket with the video.
+        """
+        signature, keys = self.signature(shingles)
+
+        return np.unique(self.vids[self.lookup(keys)])
+
+    def similar(self, shingles, threshold=SIMILAIRTY_THRESHOLD):
+        """
+        Returns the near duplicates of a video, verified by the fraction
+        of agreeing minhashes as in the reducer.
+
+        @param shingles:  The shingles of the video.
+        @param threshold: The minimal similarity of the signatures.
+
+        @return: A list of (video id, similarity) tuples.
+        """
+        signature, keys = self.signature(shingles)
+        rows      = self.lookup(keys)
+        sims      = (self.signatures[rows] == signature).mean(axis=1)
+        passed    = sims >= threshold
+
+        return zip(self.vids[rows][passed].tolist(), sims[passed].tolist())
+
+    #----------------------------------------------------------------------
+    # SNAPSHOTS
+
+    def snapshot(self, path):
+        """
+        Writes the index to the specified directory.
+
+        @param path: The directory to write the snapshot to.
+        """
+        self.merge()
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+        np.save(os.path.join(path, 'vids.npy'),       self.vids[:self.count])
+        np.save(os.path.join(path, 'signatures.npy'), self.signatures[:self.count])
+        np.save(os.path.join(path, 'keys.npy'),       self.keys)
+        np.save(os.path.join(path, 'rows.npy'),       self.rows)
+
+        with open(os.path.join(path, 'meta.json'), "w") as outf:
+            json.dump({'bands':        BANDS,
+                       'rows':         ROWS,
+                       'band_buckets': BAND_BUCKETS,
+                       'parameters':   str(parameters())}, outf)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Loads a snapshot written by snapshot. The tables are memory mapped
+        and only copied once new videos are inserted.
+
+        @param path: The directory to load the snapshot from.
+
+        @return: The loaded index.
+        """
+        with open(os.path.join(path, 'meta.json'), "r") as inf:
+            meta = json.load(inf)
+
+        if meta['parameters'] != str(parameters()) or \
+           meta['bands'] != BANDS or meta['band_buckets'] != BAND_BUCKETS:
+            raise ValueError("Snapshot uses different hash parameters")
+
+        index = cls()
+        index.vids       = np.load(os.path.join(path, 'vids.npy'),       mmap_mode='r')
+        index.signatures = np.load(os.path.join(path, 'signatures.npy'), mmap_mode='r')
+        index.keys       = np.load(os.path.join(path, 'keys.npy'),       mmap_mode='r')
+        index.rows       = np.load(os.path.join(path, 'rows.npy'),       mmap_mode='r')
+        index.count      = len(index.vids)
+
+        return index
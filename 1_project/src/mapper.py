@@ -1,9 +1,19 @@
 #!/local/anaconda/bin/python
 # IMPORTANT: leave the above line as is.
 
+import argparse
+import base64
+import json
 import numpy as np
+import os
 import sys
 
+# The parsers and formats shared by all projects.
+TOOLS = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..',
+                     'tools')
+sys.path.append(TOOLS)
+import textparse
+
 # VERY IMPORTANT:
 # Make sure that each machine is using the
 # same seed when generating random numbers for the hash functions.
@@ -16,16 +26,42 @@ SHINGLES = 20000
 
 BANDS    = 64
 ROWS     = 16
-HASHES   = BANDS*ROWS
 
 SHINGLE_BUCKETS   = SHINGLES
 BAND_BUCKETS      = 103549
 #BAND_BUCKETS      = 15667
 #BAND_BUCKETS      = 217219
 
+# TUNING
+# The configuration chosen by tune.py overrides the defaults above. It is
+# read from lsh.json next to the mapper, or from the file in LSH_CONFIG.
+CONFIG_FILE = os.environ.get('LSH_CONFIG', os.path.join(
+   os.path.dirname(os.path.abspath(__file__)), 'lsh.json'))
+
+if os.path.exists(CONFIG_FILE):
+   with open(CONFIG_FILE, "r") as inf:
+      config = json.load(inf)
+
+   BANDS        = int(config.get('bands',        BANDS))
+   ROWS         = int(config.get('rows',         ROWS))
+   BAND_BUCKETS = int(config.get('band_buckets', BAND_BUCKETS))
+
+HASHES   = BANDS*ROWS
+
 # CHECKS
-if HASHES > 1024:
-   sys.exit("Too many hash functions: %d" % HASHES)   
+# The hash functions take two distinct primes each from the primes below
+# SHINGLES, which limits their number.
+MAX_HASHES = 1024
+
+if BANDS < 1 or ROWS < 1 or HASHES > MAX_HASHES:
+   sys.exit("Invalid LSH configuration%s: bands=%d, rows=%d, bands*rows "
+            "must be between 1 and %d" % (
+               " in " + CONFIG_FILE if os.path.exists(CONFIG_FILE) else "",
+               BANDS, ROWS, MAX_HASHES))
+
+if BAND_BUCKETS < 2:
+   sys.exit("Invalid LSH configuration: band_buckets=%d must be at least 2"
+            % BAND_BUCKETS)
 
 #--------------------------------------------------------------------------
 # PRIMES
@@ -43,6 +79,10 @@ np.random.shuffle(PRIMES)
 A_PRIMES = PRIMES[0:HASHES]
 B_PRIMES = PRIMES[HASHES:2*HASHES]
 
+# Added to every band hash. A fixed prime, which does not depend on the
+# number of hash functions.
+BAND_OFFSET = PRIMES[42]
+
 #--------------------------------------------------------------------------
 # HASHES
 
@@ -60,6 +100,50 @@ def hash_shingle(i, shingle):
 #--------------------------------------------------------------------------
 # MINHASH
 
+# The batched engine evaluates every hash function on a whole block of
+# shingles at once. A block holds about BLOCK_SHINGLES shingles, which
+# keeps the (HASHES x BLOCK_SHINGLES) hash matrix at around 64MB.
+BLOCK_SHINGLES = 8192
+HASH_INDICES   = np.arange(HASHES)[:, np.newaxis]
+
+# For shingles below SHINGLE_LIMIT all intermediate hash values fit into
+# 32 bit integers, which makes hashing about three times faster.
+HASH_A32       = A_PRIMES.astype(np.int32)[:, np.newaxis]
+HASH_B32       = B_PRIMES.astype(np.int32)[:, np.newaxis]
+SHINGLE_LIMIT  = (np.iinfo(np.int32).max - B_PRIMES.max())//A_PRIMES.max()
+
+def produce_signatures(shingle_lists):
+   """
+   Produces the minhash signatures for a block of videos at once.
+
+   @param shingle_lists: A list of shingle arrays, one per video.
+
+   @return: A matrix holding the minhash signature of the i-th video
+            in its i-th row.
+   """
+   count      = len(shingle_lists)
+   signatures = np.full((count, HASHES), SHINGLE_BUCKETS, dtype=int)
+   lengths    = np.array([len(sh) for sh in shingle_lists], dtype=int)
+   filled     = np.nonzero(lengths)[0]
+
+   if len(filled) == 0:
+      return signatures
+
+   # Hash the concatenation of all shingles with all hash functions by
+   # broadcasting. The minimum of each video is then reduced over the
+   # segment of columns that belongs to its shingles.
+   shingles = np.concatenate([shingle_lists[i] for i in filled])
+   offsets  = np.cumsum(lengths[filled]) - lengths[filled]
+
+   if shingles.min() >= 0 and shingles.max() < SHINGLE_LIMIT:
+      hashes = (HASH_A32*shingles.astype(np.int32) + HASH_B32) % SHINGLE_BUCKETS
+   else:
+      hashes = hash_shingle(HASH_INDICES, shingles)
+
+   signatures[filled] = np.minimum.reduceat(hashes, offsets, axis=1).T
+
+   return signatures
+
 def produce_signature(shingles):
    """
    Produces a minhash signature for the specified list of shingles.
@@ -68,25 +152,15 @@ def produce_signature(shingles):
 
    @return: The minhash signature for the list of shingles.
    """
-   signature = np.full(HASHES, SHINGLE_BUCKETS, dtype=int)
-
-   # For each hash function, we need to iterate over all shingles and
-   # evaluate their hash value. We keep track of the minimum and update
-   # it along the way.
-   for hi in xrange(0, HASHES):
-      for sh in shingles:
-         h = hash_shingle(hi, sh)
-
-         if h < signature[hi]:
-            signature[hi] = h
-
-   return signature
+   return produce_signatures([np.asarray(shingles, dtype=int)])[0]
 
 #--------------------------------------------------------------------------
 # LOCALITY SENSITIVE HASHING
 
 BAND_HASHES = np.random.randint(1, BAND_BUCKETS, size=(HASHES, 2))
 
+BAND_PRIMES = B_PRIMES[0:HASHES].reshape(BANDS, ROWS)
+
 def hash_band(i, signature):
    """
    Return the hash value of the specified band in the signature.
@@ -96,13 +170,24 @@ def hash_band(i, signature):
 
    @return: The hash value of the band between 0 and BAND_BUCKETS.
    """
-   start_index = ROWS*i
-   end_index   = ROWS*(i+1)
-   hash_value  = 0
-   for i in xrange(start_index, end_index):
-      hash_value = (hash_value + B_PRIMES[i]*signature[i]) %BAND_BUCKETS
+   rows       = signature[ROWS*i:ROWS*(i+1)]
+   hash_value = np.dot(BAND_PRIMES[i], rows) % BAND_BUCKETS
 
-   return (hash_value + A_PRIMES[42]) % BAND_BUCKETS
+   return (hash_value + BAND_OFFSET) % BAND_BUCKETS
+
+def hash_bands(signatures):
+   """
+   Return the hash values of all bands of a block of signatures.
+
+   @param signatures: A matrix holding one signature per row.
+
+   @return: A matrix holding the hash values of the bands of the i-th
+            signature in its i-th row.
+   """
+   bands       = signatures.reshape(-1, BANDS, ROWS)
+   hash_values = (bands*BAND_PRIMES).sum(axis=2) % BAND_BUCKETS
+
+   return (hash_values + BAND_OFFSET) % BAND_BUCKETS
 
 #--------------------------------------------------------------------------
 # MAIN
@@ -122,28 +207,192 @@ def prepare(line):
 
    return (vid, shin)
 
-def emit(vid, band, hashv, sig):
+def split_blocks(vids, values, offsets, first, last, size):
+   """
+   Groups the videos of a ragged chunk into blocks, such that each block
+   holds about the specified amount of shingles.
+
+   @param vids:    The video ids of the chunk.
+   @param values:  The shingles of all videos of the chunk.
+   @param offsets: The offsets of the shingles of each video in values.
+   @param first:   The first video to group.
+   @param last:    The video after the last one to group.
+   @param size:    The amount of shingles per block.
+
+   @return: A generator of (video ids, shingle arrays) tuples.
+   """
+   while first < last:
+      end = np.searchsorted(offsets, offsets[first] + size, side='right')
+      end = min(max(end, first + 1), last)
+      yield ([int(v) for v in vids[first:end]],
+             [values[offsets[i]:offsets[i + 1]] for i in xrange(first, end)])
+      first = end
+
+def read_blocks(stream, size=BLOCK_SHINGLES):
+   """
+   Reads videos from the stream and groups them into blocks, such that
+   each block holds about the specified amount of shingles.
+
+   @param stream: The stream to read videos from.
+   @param size:   The amount of shingles per block.
+
+   @return: A generator of (video ids, shingle arrays) tuples.
+   """
+   for vids, values, offsets in textparse.videos(stream):
+      for block in split_blocks(vids, values, offsets, 0, len(vids), size):
+         yield block
+
+# BINARY INPUT
+# Instead of stdin, the mapper reads a dataset written by tools/binfmt.py,
+# optionally only the videos in a byte range of its shingles.
+
+def read_binary_blocks(path, byte_range=None, size=BLOCK_SHINGLES):
+   """
+   Reads videos from a binary dataset and groups them into blocks like
+   read_blocks. The shingles are views of the memory mapped dataset.
+
+   @param path:       The dataset to read.
+   @param byte_range: The 'START:END' byte range to read, or None.
+   @param size:       The amount of shingles per block.
+
+   @return: A generator of (video ids, shingle arrays) tuples.
+   """
+   import binfmt
+
+   dataset, first, last = binfmt.open_range(path, byte_range)
+   values, offsets      = dataset.column('shingles')
+   vids                 = dataset.column('vids')
+
+   return split_blocks(vids, values, offsets, first, last, size)
+
+# OUTPUT FORMATS
+#
+# text:    Every band emits "(band,hash), (vid,s.s.s...)", i.e. the whole
+#          signature as dotted decimal string.
+# compact: Every video emits its signature once as "(!sig,vid), base64",
+#          where base64 encodes the signature as little endian uint16.
+#          The bands only refer to the video by "(band,hash), vid". The
+#          '!' sorts the signatures before all buckets, so the reducer
+#          can verify every bucket as it streams by. The signature and
+#          the buckets of a video hash to different partitions, so the
+#          format requires a single reducer.
+FORMATS        = ['text', 'compact']
+SIGNATURE_KEY  = "(!sig,%s)"
+
+# The number of reducers of the job, as exported to the tasks by Hadoop
+# streaming and tools/mapreduce.py.
+REDUCERS_VARIABLE = 'mapreduce_job_reduces'
+
+def encode_signature(sig):
+   """
+   Encodes a signature as base64 string of little endian uint16 values.
+
+   @param sig: The signature to encode.
+
+   @return: The encoded signature.
+   """
+   return base64.b64encode(sig.astype('<u2').tobytes())
+
+def emit(vid, hashes, sig):
    """
-   Emits a new mapped pair consisting of a key defined by the band
-   and the hash value and a value consisting of the video id followed
-   by the signature as string.
+   Emits the mapped pairs of a video in text format. Each key is defined
+   by the band and its hash value and each value consists of the video
+   id followed by the signature as string.
 
-   param vid:   The id of the video.
-   param band:  The band of the hash.
-   param hashv: The hash value of the band.
-   param sig:   The hashed signature.
+   param vid:    The id of the video.
+   param hashes: The hash values of all bands.
+   param sig:    The hashed signature.
    """
    sigstr = '.'.join([str(s) for s in sig])
-   key = "(%s,%s)" % (band, hashv)
-   val = "(%s,%s)" % (vid, sigstr)
+   val    = "(%s,%s)" % (vid, sigstr)
+   lines  = ["(%s,%s), %s\n" % (band, hashv, val)
+             for band, hashv in enumerate(hashes)]
+
+   sys.stdout.write(''.join(lines))
+
+def emit_compact(vid, hashes, sig):
+   """
+   Emits the mapped pairs of a video in compact format. The signature
+   is emitted once, the bands only refer to the video id.
+
+   param vid:    The id of the video.
+   param hashes: The hash values of all bands.
+   param sig:    The hashed signature.
+   """
+   lines = [SIGNATURE_KEY % vid + ", %s\n" % encode_signature(sig)]
+   lines.extend(["(%s,%s), %s\n" % (band, hashv, vid)
+                 for band, hashv in enumerate(hashes)])
+
+   sys.stdout.write(''.join(lines))
+
+#--------------------------------------------------------------------------
+# SIGNATURE CACHE
+
+def parameters():
+   """
+   Returns the key identifying the parameters of the hash functions.
+   Signatures can only be reused for the same key.
+   """
+   from sigcache import parameters_key
+   return parameters_key(SHINGLE_BUCKETS, A_PRIMES, B_PRIMES)
+
+def cached_signatures(vids, shingles, cache):
+   """
+   Produces the minhash signatures for a block of videos, taking the
+   signatures of videos hashed in earlier runs from the cache. Only the
+   missing signatures are computed and added to the cache.
+
+   @param vids:     The ids of the videos.
+   @param shingles: A list of shingle arrays, one per video.
+   @param cache:    The signature cache to use.
+
+   @return: A matrix holding the minhash signature of the i-th video
+            in its i-th row.
+   """
+   found, signatures = cache.lookup(vids, HASHES)
+   missing           = np.nonzero(~found)[0]
+
+   if len(missing) > 0:
+      computed = produce_signatures([shingles[i] for i in missing])
+      signatures[missing] = computed
+      cache.append([vids[i] for i in missing], computed)
 
-   print("%s, %s" % (key, val))
+   return signatures
 
 if __name__ == "__main__":
-   for line in sys.stdin:
-      vid, shingles = prepare(line)
-      signature     = produce_signature(shingles)
-      for band in xrange(0, BANDS):
-         hashv = hash_band(band, signature)
-         emit(vid, band, hashv, signature)
-        
+   parser = argparse.ArgumentParser(description="LSH mapper")
+   parser.add_argument('--format', choices=FORMATS, default='text',
+                       help="the format of the emitted records")
+   parser.add_argument('--cache', metavar='PATH',
+                       help="reuse the signatures stored in the cache")
+   parser.add_argument('--dataset', metavar='PATH',
+                       help="read the videos from a binary dataset")
+   parser.add_argument('--range', metavar='START:END',
+                       help="only read this byte range of the dataset")
+   args = parser.parse_args()
+
+   if args.format == 'compact' and \
+      int(os.environ.get(REDUCERS_VARIABLE, 1)) > 1:
+      parser.error("--format compact requires a single reducer, the job "
+                   "has %s" % os.environ[REDUCERS_VARIABLE])
+
+   emitter = emit_compact if args.format == 'compact' else emit
+   cache   = None
+
+   if args.cache:
+      from sigcache import SignatureCache
+      cache = SignatureCache(args.cache, parameters())
+
+   if args.dataset:
+      blocks = read_binary_blocks(args.dataset, args.range)
+   else:
+      blocks = read_blocks(sys.stdin)
+
+   for vids, shingles in blocks:
+      if cache is None:
+         signatures = produce_signatures(shingles)
+      else:
+         signatures = cached_signatures(vids, shingles, cache)
+      hashes     = hash_bands(signatures)
+      for vid, signature, hashv in zip(vids, signatures, hashes):
+         emitter(vid, hashv, signature)
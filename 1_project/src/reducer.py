@@ -1,6 +1,8 @@
 #!/local/anaconda/bin/python
 # IMPORTANT: leave the above line as is.
 
+import argparse
+import base64
 import numpy as np
 import sys
 
@@ -8,24 +10,46 @@ import sys
 # CONSTANTS
 
 SIMILAIRTY_THRESHOLD = 0.9
+SIGNATURE_KEY        = "(!sig,"
+VALUE_SEPARATOR      = ";"
 
 #--------------------------------------------------------------------------
 # VALUE EXTRACTION
 
+def decode_signature(sigstr):
+    """
+    Decodes a signature, which is either a dotted decimal string (text
+    format) or base64 encoded little endian uint16 values (compact format).
+
+    @param sigstr: The signature string to decode.
+
+    @return: The signature.
+    """
+    if '.' in sigstr:
+        return np.fromstring(sigstr, dtype=int, sep='.')
+
+    return np.frombuffer(base64.b64decode(sigstr), dtype='<u2').astype(int)
+
 def prepare(value):
     """
-    Prepares a value string and extracts relevant information.
+    Prepares a value string and extracts relevant information. The
+    signature string is not decoded, such that signatures of videos
+    which are already known do not need to be parsed again.
 
     @param value: The value string to process.
 
-    @return: A tuple containing the video id and a signature.
+    @return: A tuple containing the video id and a signature string. The
+             signature string is None if the value only refers to the video.
     """ 
     value = value.lstrip('(')
     value = value.rstrip(')')
+
+    if ',' not in value:
+        return (int(value), None)
+
     vid, sigstr = value.split(',')
-    sig = np.fromstring(sigstr, dtype=int, sep='.')
 
-    return (int(vid), sig)
+    return (int(vid), sigstr)
 
 #--------------------------------------------------------------------------
 # SIMILARITY
@@ -45,41 +69,191 @@ def similarity(sig1, sig2):
 
     return (sig1 == sig2).sum()/h
 
+#--------------------------------------------------------------------------
+# VERIFICATION
+
+class Verifier(object):
+    """
+    Verifies the candidate pairs of all buckets. Signatures are cached by
+    video id and every pair is scored at most once across all buckets.
+
+    A bucket is scored as a whole. The signatures are viewed as packed
+    words of four uint16 values each, so a pair is first compared on a
+    quarter of the values. Every mismatching value breaks at most one
+    word, which gives an exact lower bound on the matching words of any
+    pair above the threshold. Only pairs passing that bound are compared
+    value by value.
+
+    If a shingle store is given, pairs accepted on their signatures are
+    re-ranked by the exact Jaccard similarity of their shingle sets.
+    Pairs with videos missing from the store keep the signature decision.
+    """
+
+    # Bounds the size of the (BLOCK x bucket x words) comparison tensor.
+    BLOCK_SIZE = 1 << 22
+
+    def __init__(self, threshold=SIMILAIRTY_THRESHOLD, store=None,
+                 jaccard_threshold=SIMILAIRTY_THRESHOLD):
+        self.threshold  = threshold
+        self.signatures = {}
+        self.seen       = set()
+
+        self.store             = store
+        self.jaccard_threshold = jaccard_threshold
+
+    def __contains__(self, vid):
+        return vid in self.signatures
+
+    def add(self, vid, sigstr):
+        """
+        Caches the signature of a video unless it is already known.
+
+        @param vid:    The id of the video.
+        @param sigstr: The signature string of the video.
+        """
+        if vid not in self.signatures:
+            self.signatures[vid] = decode_signature(sigstr).astype('<u2')
+
+    def verify(self, vids):
+        """
+        Scores all pairs of a bucket which have not been scored before.
+
+        @param vids: The ids of the videos in the bucket.
+
+        @return: A list of similar (smaller id, larger id) pairs.
+        """
+        unique = np.unique([vid for vid in vids if vid in self.signatures])
+        count  = len(unique)
+        if count < 2:
+            return []
+
+        sigs   = np.vstack([self.signatures[vid] for vid in unique])
+        length = sigs.shape[1]
+        needed = int(np.floor(self.threshold*length))
+
+        if length % 4 == 0:
+            words     = sigs.view('<u8')
+            min_words = words.shape[1] - (length - needed)
+        else:
+            words     = sigs
+            min_words = needed
+
+        block  = max(1, self.BLOCK_SIZE // (count*words.shape[1]))
+        result = []
+
+        for start in xrange(0, count - 1, block):
+            end     = min(start + block, count - 1)
+            matches = (words[start:end, np.newaxis, :] == words).sum(axis=2)
+            rows    = np.arange(start, end)[:, np.newaxis]
+            passed  = (matches >= min_words) & (np.arange(count) > rows)
+
+            for i, j in zip(*np.nonzero(passed)):
+                i    += start
+                pair  = (unique[i], unique[j])
+                if pair in self.seen:
+                    continue
+
+                self.seen.add(pair)
+                if similarity(sigs[i], sigs[j]) < self.threshold:
+                    continue
+
+                if self.rerank(pair):
+                    result.append(pair)
+
+        return result
+
+    def rerank(self, pair):
+        """
+        Checks a candidate pair against the exact Jaccard similarity.
+
+        @param pair: The pair of video ids to check.
+
+        @return: True if the pair is to be reported, false else.
+        """
+        if self.store is None:
+            return True
+
+        vid1, vid2 = pair
+        if vid1 not in self.store or vid2 not in self.store:
+            return True
+
+        return self.store.jaccard(vid1, vid2) >= self.jaccard_threshold
+
 #--------------------------------------------------------------------------
 # OUTPUT
 
-def emit_similar(videos):
-    count  = 0
-    mapped = [prepare(vid) for vid in videos]
-    lookup = {key: value   for (key, value) in mapped}
-    unique = np.unique([vid for (vid, sig) in mapped])
-    for i in xrange(len(unique)):
-        for j in xrange(i + 1, len(unique)):
-            if similarity(lookup[unique[i]], lookup[unique[j]]) >= SIMILAIRTY_THRESHOLD:
-                print "%d\t%d" % (min(unique[i], unique[j]),
-                                  max(unique[i], unique[j]))
+def emit_similar(pairs):
+    for (vid1, vid2) in pairs:
+        print "%d\t%d" % (vid1, vid2)
 
 
 #--------------------------------------------------------------------------
 # MAIN
 
-last_key    = None
-candidates  = []
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="LSH reducer")
+    parser.add_argument('--shingles', metavar='STORE',
+                        help="re-rank pairs with the shingle store "
+                             "built by shingles.py")
+    parser.add_argument('--jaccard', type=float,
+                        default=SIMILAIRTY_THRESHOLD,
+                        help="the Jaccard similarity required for a pair")
+    args = parser.parse_args()
+
+    store = None
+    if args.shingles:
+        from shingles import ShingleStore
+        store = ShingleStore(args.shingles)
+
+    last_key    = None
+    candidates  = []
+    verifier    = Verifier(store=store, jaccard_threshold=args.jaccard)
+    pending     = []
+
+    def flush(candidates):
+        # Buckets in compact format only refer to their videos. Their
+        # signatures sort first, a bucket whose signatures have not been
+        # read yet is resolved once all records have been read.
+        vids = []
+        for video in candidates:
+            vid, sigstr = prepare(video)
+            if sigstr is not None:
+                verifier.add(vid, sigstr)
+            vids.append(vid)
+
+        if all(vid in verifier for vid in vids):
+            emit_similar(verifier.verify(vids))
+        else:
+            pending.append(vids)
+
+    for line in sys.stdin:
+        line = line.strip()
+        key, video = line.split(", ")
+
+        if key.startswith(SIGNATURE_KEY):
+            verifier.add(int(key[len(SIGNATURE_KEY):-1]), video)
+            continue
+
+        if last_key is None:
+            last_key = key
 
-for line in sys.stdin:
-    line = line.strip()
-    key, video = line.split(", ")
+        # A combiner may have merged several values into one record.
+        videos = video.split(VALUE_SEPARATOR)
 
-    if last_key is None:
-        last_key = key
+        if key == last_key:
+            candidates.extend(videos)
+        else:
+            # Key changed (previous line was k=x, this line is k=y)
+            flush(candidates)
+            candidates  = videos
+            last_key    = key
 
-    if key == last_key:
-        candidates.append(video)
-    else:
-        # Key changed (previous line was k=x, this line is k=y)
-        emit_similar(candidates)
-        candidates  = [video]
-        last_key    = key
+    if len(candidates) > 0:
+        flush(candidates)
 
-if len(candidates) > 0:
-    emit_similar(candidates)
+    for vids in pending:
+        missing = [vid for vid in vids if vid not in verifier]
+        if missing:
+            sys.exit("No signature for video %d; the compact format needs "
+                     "all records in a single reducer" % missing[0])
+        emit_similar(verifier.verify(vids))
@@ -0,0 +1,152 @@
+#!/local/anaconda/bin/python
+# IMPORTANT: leave the above line as is.
+
+import numpy as np
+import sys
+
+#--------------------------------------------------------------------------
+# CONSTANTS
+
+SHINGLE_TYPE = np.dtype('<u2')
+SHINGLE_MAX  = np.iinfo(SHINGLE_TYPE).max
+
+#--------------------------------------------------------------------------
+# STORE LAYOUT
+#
+# A shingle store consists of three .npy files sharing a common prefix:
+#
+# <store>.ids.npy:      The sorted video ids (int64).
+# <store>.offsets.npy:  The offset of the shingles of the i-th video and
+#                       the offset past them (int64, one more than ids).
+# <store>.shingles.npy: The sorted and unique shingles of all videos,
+#                       concatenated in the order of the ids (uint16).
+
+def paths(store):
+    """
+    Returns the paths of the files making up the specified store.
+
+    @param store: The path prefix of the store.
+
+    @return: The paths to the ids, offsets and shingles files.
+    """
+    return (store + '.ids.npy', store + '.offsets.npy', store + '.shingles.npy')
+
+#--------------------------------------------------------------------------
+# BUILDING
+
+def prepare(line):
+    """
+    Extracts the video id and the shingle set from a line of input.
+
+    @param line: The line to process.
+
+    @return: The video id and the sorted unique shingles of the video.
+    """
+    line = line.strip()
+    vid  = int(line[6:15])
+    shin = np.unique(np.fromstring(line[16:], dtype=int, sep=" "))
+
+    if len(shin) > 0 and (shin[0] < 0 or shin[-1] > SHINGLE_MAX):
+        raise ValueError("Shingle of video %d out of range" % vid)
+
+    return (vid, shin.astype(SHINGLE_TYPE))
+
+def build(training, store):
+    """
+    Builds a shingle store from the specified training file.
+
+    @param training: The path to the training file.
+    @param store:    The path prefix of the store to build.
+
+    @return: The number of videos in the store.
+    """
+    vids     = []
+    shingles = []
+
+    with open(training, "r") as inf:
+        for line in inf:
+            if line.strip():
+                vid, shin = prepare(line)
+                vids.append(vid)
+                shingles.append(shin)
+
+    order   = np.argsort(vids, kind='mergesort')
+    lengths = np.array([len(shingles[i]) for i in order], dtype=np.int64)
+    offsets = np.zeros(len(order) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+
+    ids_path, offsets_path, shingles_path = paths(store)
+    np.save(ids_path,      np.array(vids, dtype=np.int64)[order])
+    np.save(offsets_path,  offsets)
+    np.save(shingles_path, np.concatenate([shingles[i] for i in order] +
+                                          [np.zeros(0, SHINGLE_TYPE)]))
+
+    return len(order)
+
+#--------------------------------------------------------------------------
+# LOOKUP
+
+class ShingleStore(object):
+    """
+    Read only access to a shingle store. All files are memory mapped, so
+    only the shingle sets which are actually looked up are paged in.
+    """
+
+    def __init__(self, store):
+        ids_path, offsets_path, shingles_path = paths(store)
+
+        self.ids      = np.load(ids_path,      mmap_mode='r')
+        self.offsets  = np.load(offsets_path,  mmap_mode='r')
+        self.shingles = np.load(shingles_path, mmap_mode='r')
+
+    def __contains__(self, vid):
+        index = np.searchsorted(self.ids, vid)
+        return index < len(self.ids) and self.ids[index] == vid
+
+    def __len__(self):
+        return len(self.ids)
+
+    def get(self, vid):
+        """
+        Returns the shingle set of the specified video.
+
+        @param vid: The id of the video.
+
+        @return: The sorted unique shingles of the video.
+        """
+        index = np.searchsorted(self.ids, vid)
+        if index == len(self.ids) or self.ids[index] != vid:
+            raise KeyError(vid)
+
+        return self.shingles[self.offsets[index]:self.offsets[index + 1]]
+
+    def jaccard(self, vid1, vid2):
+        """
+        Computes the exact Jaccard similarity of the shingle sets of two
+        videos with a single sorted array intersection.
+
+        @param vid1: The id of the first video.
+        @param vid2: The id of the second video.
+
+        @return: The Jaccard similarity of the two videos.
+        """
+        shin1 = self.get(vid1)
+        shin2 = self.get(vid2)
+        inter = len(np.intersect1d(shin1, shin2, assume_unique=True))
+        union = len(shin1) + len(shin2) - inter
+
+        if union == 0:
+            return 1.0
+
+        return inter/float(union)
+
+#--------------------------------------------------------------------------
+# MAIN
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print "Usage: python shingles.py training_file store"
+        exit(-1)
+
+    count = build(sys.argv[1], sys.argv[2])
+    print "Stored the shingles of %d videos in %s" % (count, sys.argv[2])
@@ -0,0 +1,175 @@
+#!/local/anaconda/bin/python
+# IMPORTANT: leave the above line as is.
+
+import fcntl
+import hashlib
+import numpy as np
+import os
+
+#--------------------------------------------------------------------------
+# CONSTANTS
+
+SIGNATURE_TYPE = np.dtype('<u2')
+INDEX_TYPE     = np.dtype([('vid',    '<i8'),
+                           ('params', '<u8'),
+                           ('offset', '<i8'),
+                           ('length', '<i8')])
+
+#--------------------------------------------------------------------------
+# CACHE LAYOUT
+#
+# A signature cache consists of two append only files sharing a prefix:
+#
+# <cache>.sig: The signatures as uint16 values, one after the other.
+# <cache>.idx: One INDEX_TYPE record per signature, holding the video id,
+#              the key of the hashing parameters, and the offset and
+#              length of the signature in the .sig file.
+#
+# Signatures are only appended after their data has been written, so a
+# crashed run leaves at most some unreferenced data behind. If a video is
+# stored more than once, the last record wins. Writers append while they
+# hold an exclusive lock on the .sig file, so parallel mappers may share a
+# cache.
+#
+# The index is read into memory in full when a cache is opened, so its
+# size grows with the number of cached videos. Only the signatures are
+# memory mapped, and read when they are looked up.
+
+def parameters_key(*values):
+    """
+    Computes the key of a set of hashing parameters.
+
+    @param values: The parameters, scalars or arrays.
+
+    @return: A 64 bit key identifying the parameters.
+    """
+    digest = hashlib.sha1()
+    for value in values:
+        value = np.asarray(value)
+        digest.update(value.dtype.str)
+        digest.update(str(value.shape))
+        digest.update(value.tobytes())
+
+    return int(np.frombuffer(digest.digest()[:8], dtype='<u8')[0])
+
+class SignatureCache(object):
+    """
+    A persistent store of minhash signatures, keyed by video id and the
+    key of the hashing parameters they were computed with. The index of
+    the signatures is held in memory.
+    """
+
+    def __init__(self, path, params):
+        """
+        Opens the cache at the specified path, creating it if necessary,
+        and reads the records of its index that match the parameters.
+
+        @param path:   The path prefix of the cache.
+        @param params: The key of the hashing parameters in use.
+        """
+        self.data_path  = path + '.sig'
+        self.index_path = path + '.idx'
+        self.params     = np.uint64(params)
+        self.data       = None
+
+        for name in (self.data_path, self.index_path):
+            if not os.path.exists(name):
+                open(name, 'ab').close()
+
+        index = self.map(self.index_path, INDEX_TYPE)
+        index = index[index['params'] == self.params]
+
+        # Sort stably by id and keep the last record of every video.
+        order = np.argsort(index['vid'], kind='mergesort')
+        index = index[order]
+        last  = np.ones(len(index), dtype=bool)
+        last[:-1] = index['vid'][1:] != index['vid'][:-1]
+
+        self.vids    = np.array(index['vid'][last])
+        self.offsets = np.array(index['offset'][last])
+        self.lengths = np.array(index['length'][last])
+        self.added   = {}
+
+    def __len__(self):
+        return len(self.vids) + len(self.added)
+
+    @staticmethod
+    def map(path, dtype):
+        """
+        Memory maps a file as array of the specified type.
+        """
+        if os.path.getsize(path) < dtype.itemsize:
+            return np.zeros(0, dtype=dtype)
+
+        return np.memmap(path, dtype=dtype, mode='r')
+
+    def lookup(self, vids, size):
+        """
+        Looks up the signatures of the specified videos.
+
+        @param vids: The ids of the videos.
+        @param size: The length of the signatures.
+
+        @return: A boolean array marking the videos found and a matrix
+                 holding their signatures in the respective rows.
+        """
+        vids       = np.asarray(vids, dtype=np.int64)
+        found      = np.zeros(len(vids), dtype=bool)
+        signatures = np.zeros((len(vids), size), dtype=int)
+
+        index = np.searchsorted(self.vids, vids)
+        index = np.minimum(index, max(len(self.vids) - 1, 0))
+        if len(self.vids) > 0:
+            found = (self.vids[index] == vids) & (self.lengths[index] == size)
+
+        for row in np.nonzero(found)[0]:
+            if self.data is None:
+                self.data = self.map(self.data_path, SIGNATURE_TYPE)
+
+            start = self.offsets[index[row]]
+            signatures[row] = self.data[start:start + size]
+
+        for row, vid in enumerate(vids):
+            signature = self.added.get(vid)
+            if signature is not None and len(signature) == size:
+                signatures[row] = signature
+                found[row]      = True
+
+        return (found, signatures)
+
+    def append(self, vids, signatures):
+        """
+        Appends the signatures of the specified videos to the cache.
+
+        @param vids:       The ids of the videos.
+        @param signatures: A matrix holding the signatures in its rows.
+        """
+        if len(vids) == 0:
+            return
+
+        signatures = np.asarray(signatures).astype(SIGNATURE_TYPE)
+        records    = np.zeros(len(vids), dtype=INDEX_TYPE)
+
+        records['vid']    = vids
+        records['params'] = self.params
+        records['length'] = signatures.shape[1]
+
+        # The offset is only known once the lock is held, as other writers
+        # may have appended to the cache since it was opened.
+        with open(self.data_path, 'ab') as outf:
+            fcntl.flock(outf, fcntl.LOCK_EX)
+            try:
+                outf.seek(0, os.SEEK_END)
+                start = outf.tell()//SIGNATURE_TYPE.itemsize
+                records['offset'] = start + \
+                    signatures.shape[1]*np.arange(len(vids))
+
+                outf.write(signatures.tobytes())
+                outf.flush()
+                with open(self.index_path, 'ab') as index:
+                    index.write(records.tobytes())
+            finally:
+                fcntl.flock(outf, fcntl.LOCK_UN)
+
+        for vid, signature in zip(vids, signatures):
+            self.added[vid] = signature
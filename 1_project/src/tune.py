@@ -0,0 +1,230 @@
+#!/local/anaconda/bin/python
+# IMPORTANT: leave the above line as is.
+
+import argparse
+import json
+import math
+import numpy as np
+import sys
+
+from shingles import prepare
+
+#--------------------------------------------------------------------------
+# CONSTANTS
+
+HASH_BUDGET    = 1024   # The most hash functions the mapper supports.
+BAND_BUCKETS   = 103549
+THRESHOLD      = 0.9
+RECALL         = 0.95
+RECALL_SLACK   = 0.01
+SAMPLE_VIDEOS  = 2000
+HISTOGRAM_BINS = 1000
+
+#--------------------------------------------------------------------------
+# SIMILARITY DISTRIBUTION
+
+def load(training):
+    """
+    Loads the shingle sets of all videos of the training file.
+
+    @param training: The path to the training file.
+
+    @return: A dictionary mapping video ids to sorted unique shingles.
+    """
+    videos = {}
+    with open(training, "r") as inf:
+        for line in inf:
+            if line.strip():
+                vid, shin = prepare(line)
+                videos[vid] = shin
+
+    return videos
+
+def jaccard(shin1, shin2):
+    """
+    Computes the Jaccard similarity of two sorted unique shingle arrays.
+    """
+    inter = len(np.intersect1d(shin1, shin2, assume_unique=True))
+    union = len(shin1) + len(shin2) - inter
+
+    return inter/float(union) if union > 0 else 1.0
+
+def sample_similarities(videos, count, rng):
+    """
+    Computes the similarity of all pairs within a uniform sample of the
+    videos, which is a uniform sample of all pairs. The intersections are
+    computed at once as product of the shingle incidence matrix.
+
+    @param videos: A dictionary mapping video ids to shingle sets.
+    @param count:  The number of videos to sample.
+    @param rng:    The random state to sample with.
+
+    @return: The similarities of all sampled pairs.
+    """
+    vids   = sorted(videos)
+    sample = rng.permutation(len(vids))[:count]
+    sets   = [videos[vids[i]] for i in sample]
+    width  = max([int(shin[-1]) + 1 for shin in sets if len(shin) > 0] + [1])
+
+    incidence = np.zeros((len(sets), width), dtype=np.float32)
+    for row, shin in enumerate(sets):
+        incidence[row, shin] = 1.0
+
+    sizes = incidence.sum(axis=1)
+    inter = incidence.dot(incidence.T)
+    union = sizes[:, np.newaxis] + sizes - inter
+    upper = np.triu_indices(len(sets), 1)
+
+    return (inter[upper]/np.maximum(union[upper], 1.0)).astype(float)
+
+#--------------------------------------------------------------------------
+# S-CURVE
+
+def configurations(budget):
+    """
+    Returns all splits of the hash budget into bands and rows.
+
+    @param budget: The maximal number of hash functions.
+
+    @return: The arrays of bands and rows of all configurations.
+    """
+    pairs = [(b, r) for r in xrange(1, budget + 1)
+                    for b in xrange(1, budget//r + 1)]
+    bands, rows = zip(*pairs)
+
+    return (np.array(bands), np.array(rows))
+
+def collision(sims, bands, rows, buckets):
+    """
+    Models the probability of two videos becoming candidates, that is
+    1-(1-s^r)^b, where a band also collides spuriously in one of the
+    band buckets.
+
+    @param sims:    The similarities of the pairs.
+    @param bands:   The numbers of bands of the configurations.
+    @param rows:    The numbers of rows of the configurations.
+    @param buckets: The number of band buckets.
+
+    @return: A matrix with the probabilities of the pairs in the columns
+             for the configurations in the rows.
+    """
+    band = np.power(sims[np.newaxis, :], rows[:, np.newaxis])
+    band = band + (1.0 - band)/buckets
+
+    return 1.0 - np.power(1.0 - band, bands[:, np.newaxis])
+
+def verification(sims, hashes, threshold):
+    """
+    Models the probability of a candidate pair passing the signature check
+    of the reducer, that is at least threshold*hashes of the minhashes
+    agreeing. The binomial tail is approximated by a normal distribution.
+
+    @param sims:      The similarities of the pairs.
+    @param hashes:    The numbers of hash functions of the configurations.
+    @param threshold: The similarity threshold of the reducer.
+
+    @return: A matrix with the probabilities of the pairs in the columns
+             for the configurations in the rows.
+    """
+    mean  = sims[np.newaxis, :]
+    std   = np.sqrt(mean*(1.0 - mean)/hashes[:, np.newaxis])
+    score = (mean - threshold)/np.maximum(std, 1e-12)
+    erf   = np.frompyfunc(math.erf, 1, 1)
+
+    return 0.5*(1.0 + erf(score/math.sqrt(2.0)).astype(float))
+
+def tune(sims, positives, total, budget, buckets, recall, threshold):
+    """
+    Picks the configuration with the cheapest expected candidate volume
+    which reaches the target recall. The recall accounts for both the
+    banding and the signature check in the reducer.
+
+    @param sims:      The similarities of the sampled pairs.
+    @param positives: The similarities of the pairs above the threshold.
+    @param total:     The total number of pairs in the data.
+    @param budget:    The maximal number of hash functions.
+    @param buckets:   The number of band buckets.
+    @param recall:    The target recall.
+    @param threshold: The similarity threshold of the reducer.
+
+    @return: A dictionary describing the chosen configuration.
+    """
+    bands, rows = configurations(budget)
+    recalls     = collision(positives, bands, rows, buckets)
+    recalls    *= verification(positives, bands*rows, threshold)
+    recalls     = recalls.mean(axis=1)
+
+    # The curve is evaluated on a histogram of the sampled similarities,
+    # which keeps the cost independent of the sample size.
+    counts, edges = np.histogram(sims, bins=HISTOGRAM_BINS, range=(0.0, 1.0))
+    centers       = (edges[:-1] + edges[1:])/2.0
+    volume        = collision(centers, bands, rows, buckets).dot(counts)
+    volume       *= total/float(max(len(sims), 1))
+
+    # The signature check limits the reachable recall. If the target is
+    # out of reach, all configurations close to the best recall qualify.
+    recall   = min(recall, recalls.max() - RECALL_SLACK)
+    feasible = np.nonzero(recalls >= recall)[0]
+
+    # Ties are broken in favour of fewer hash functions.
+    order = np.lexsort((bands[feasible]*rows[feasible], volume[feasible]))
+    best  = feasible[order[0]]
+
+    return {'bands':        int(bands[best]),
+            'rows':         int(rows[best]),
+            'band_buckets': int(buckets),
+            'recall':       float(recalls[best]),
+            'candidates':   float(volume[best])}
+
+#--------------------------------------------------------------------------
+# MAIN
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tunes the LSH bands and "
+                                     "rows on a sample of the training data.")
+    parser.add_argument('training', help="the training file")
+    parser.add_argument('--output', default='lsh.json',
+                        help="the configuration file to write")
+    parser.add_argument('--duplicates',
+                        help="a file of known duplicate pairs")
+    parser.add_argument('--threshold', type=float, default=THRESHOLD)
+    parser.add_argument('--recall',    type=float, default=RECALL)
+    parser.add_argument('--budget',    type=int,   default=HASH_BUDGET)
+    parser.add_argument('--buckets',   type=int,   default=BAND_BUCKETS)
+    parser.add_argument('--sample',    type=int,   default=SAMPLE_VIDEOS)
+    parser.add_argument('--seed',      type=int,   default=42)
+    args = parser.parse_args()
+
+    if not 1 <= args.budget <= HASH_BUDGET:
+        parser.error("--budget must be between 1 and %d" % HASH_BUDGET)
+    if args.buckets < 2:
+        parser.error("--buckets must be at least 2")
+
+    rng    = np.random.RandomState(args.seed)
+    videos = load(args.training)
+    total  = len(videos)*(len(videos) - 1)/2
+    sims   = sample_similarities(videos, args.sample, rng)
+
+    positives = list(sims[sims >= args.threshold])
+    if args.duplicates:
+        with open(args.duplicates, "r") as inf:
+            for line in inf:
+                vid1, vid2 = [int(v) for v in line.split()]
+                if vid1 in videos and vid2 in videos:
+                    positives.append(jaccard(videos[vid1], videos[vid2]))
+
+    # Without known duplicates, recall is modelled at the threshold, which
+    # is the worst case for all pairs above it.
+    if len(positives) == 0:
+        positives = [args.threshold]
+
+    config = tune(sims, np.array(positives), total, args.budget,
+                  args.buckets, args.recall, args.threshold)
+    config['threshold'] = args.threshold
+
+    with open(args.output, "w") as outf:
+        json.dump(config, outf, indent=2, sort_keys=True)
+
+    print "Bands = %d, Rows = %d, Recall = %f, Candidates = %.1f" % (
+        config['bands'], config['rows'], config['recall'],
+        config['candidates'])
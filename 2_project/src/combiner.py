@@ -0,0 +1,54 @@
+#!/local/anaconda/bin/python
+# IMPORTANT: leave the above line as is.
+
+import argparse
+import sys
+
+from mapper  import encode_coefficients
+from reducer import WEIGHTS, Accumulator, parse
+
+# The combiner merges the models emitted for the same key into their mean,
+# emitted as "key, models samples|coefficients" (or "key, models|
+# coefficients" if a record lacks the number of samples). The reducer
+# weights every record by its models or samples, so combining does not
+# change the final average as long as the combiner and the reducer are
+# given the same --weight.
+
+def emit(key, accumulator, binary):
+    string = encode_coefficients(accumulator.mean(), binary)
+    if accumulator.samples is None:
+        print("%s, %d|%s" % (key, accumulator.models, string))
+    else:
+        print("%s, %d %d|%s" % (key, accumulator.models, accumulator.samples,
+                                string))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="SVM combiner")
+    parser.add_argument('--weight', choices=WEIGHTS, default='models',
+                        help="weight the models equally or by their samples")
+    parser.add_argument('--binary', action='store_true',
+                        help="emit the coefficients in binary")
+    args = parser.parse_args()
+
+    last_key    = None
+    accumulator = None
+
+    for line in sys.stdin:
+        line = line.strip()
+        if not line:
+            continue
+
+        key, value = line.split(', ')
+
+        if key != last_key and last_key is not None:
+            emit(last_key, accumulator, args.binary)
+            accumulator = None
+
+        if accumulator is None:
+            accumulator = Accumulator(args.weight)
+
+        last_key = key
+        accumulator.add(*parse(value))
+
+    if last_key is not None:
+        emit(last_key, accumulator, args.binary)
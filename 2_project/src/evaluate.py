@@ -1,10 +1,51 @@
 #!/local/anaconda/bin/python
 # IMPORTANT: leave the above line as is.
 
+import itertools
 import logging
+import os
 import sys
 import numpy as np
 
+BLOCK_SIZE = 4096  # Test samples scored at once.
+TOOLS = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..',
+                     'tools')
+sys.path.append(TOOLS)
+import textparse
+
+def text_blocks(data, labels, size):
+    """
+    Parses the blocks of the test data and labels text files.
+
+    @return: A generator of (labels, data matrix) tuples.
+    """
+    with open(data, "r") as fp_data:
+        with open(labels, "r") as fp_labels:
+            for (x, y) in itertools.izip(textparse.dense(fp_data, size),
+                                         textparse.dense(fp_labels, size)):
+                yield (y.ravel().astype(int), x)
+
+def binary_blocks(data, labels, size):
+    """
+    Reads the blocks of a test dataset written by tools/binfmt.py. The
+    labels are read from the labels file, or from the dataset itself if
+    the labels file is a dataset too.
+
+    @return: A generator of (labels, data matrix) tuples.
+    """
+    import binfmt
+
+    x = binfmt.Dataset(data).column('features')
+    if binfmt.is_dataset(labels):
+        y = binfmt.Dataset(labels).column('labels')
+    else:
+        with open(labels, "r") as fp_labels:
+            y = np.concatenate(list(textparse.dense(fp_labels))).ravel()
+
+    for start in xrange(0, len(x), size):
+        yield (np.asarray(y[start:start + size], dtype=int),
+               x[start:start + size])
+
 if __name__ == "__main__":
     if not len(sys.argv) == 5:
         logging.error("Usage: evaluate.py weights.txt "
@@ -19,38 +60,38 @@ if __name__ == "__main__":
     with open(sys.argv[1], "r") as fp_weights:
         weights = np.genfromtxt(fp_weights).flatten()
 
+    if np.abs(np.sum(weights)) < 1e-10:
+        logging.error("Zero vector provided")
+        sys.exit(4)
+
     accuracy = 0
     total = 0
-    with open(sys.argv[2], "r") as fp_data:
-        with open(sys.argv[3], "r") as fp_labels:
-            for (x_string, label_string) in zip(fp_data, fp_labels):
-                x_string = x_string.strip()
-                label_string = label_string.strip()
-                if not x_string:
-                    assert not label_string
-                    continue
-
-                label = int(label_string)
-                if label not in (-1, 1):
-                    logging.error("Unknown label: %d" % label)
-                    sys.exit(2)
-
-                x_original = np.fromstring(x_string, sep=' ')
-
-                # Transform the features.
-                x = transform(x_original).flatten()  
-                if not x.shape == weights.shape:
-                    logging.error("Shapes of weight vector and transformed "
-                                  "data don't match")
-                    sys.exit(3)
-
-                if np.abs(np.sum(weights)) < 1e-10:
-                    logging.error("Zero vector provided")
-                    sys.exit(4)
-
-                if label*np.inner(weights, x) >= 0:
-                    accuracy += 1
-                total += 1
+    buf = None
+    if os.path.isdir(sys.argv[2]):
+        blocks = binary_blocks(sys.argv[2], sys.argv[3], BLOCK_SIZE)
+    else:
+        blocks = text_blocks(sys.argv[2], sys.argv[3], BLOCK_SIZE)
+
+    for (labels, x_original) in blocks:
+        unknown = labels[(labels != -1) & (labels != 1)]
+        if unknown.size > 0:
+            logging.error("Unknown label: %d" % unknown[0])
+            sys.exit(2)
+
+        # Transform the features of the whole block at once.
+        if buf is None:
+            buf = transform(x_original)
+            x = buf
+        else:
+            x = transform(x_original, out=buf[:len(labels)])
+
+        if not x.shape[1:] == weights.shape:
+            logging.error("Shapes of weight vector and transformed "
+                          "data don't match")
+            sys.exit(3)
+
+        accuracy += np.sum(labels*x.dot(weights) >= 0)
+        total += len(labels)
 
     print("%d" % (total))
     print("%d" % (accuracy))
@@ -0,0 +1,169 @@
+#!/local/anaconda/bin/python
+# IMPORTANT: leave the above line as is.
+
+# Trains the SVM with iterative parameter mixing: the training data is split
+# into shards, every epoch trains one model per shard on a process pool,
+# starting from the averaged model of the previous epoch, and the models are
+# averaged again. This is the mapper and reducer of the job run repeatedly,
+# with the reducer output fed back to the mappers, until the model converges.
+
+import argparse
+import logging
+import multiprocessing
+import os
+import numpy as np
+from sklearn import linear_model as LM
+
+from mapper import CLASSES, open_dataset, transform
+from reducer import average, emit
+import textparse  # On the path added by the mapper.
+
+TOLERANCE = 1e-3   # Relative change of the weights at which to stop.
+MAX_EPOCHS = 50    # Upper bound on the number of epochs.
+BLOCK_SIZE = 4096  # Samples parsed at once when loading the shards.
+
+# The shards of the training data. They are loaded before the pool is
+# created, so the worker processes inherit them instead of receiving them
+# with every task.
+SHARDS = []
+
+def load(path, count):
+    """
+    Loads the training data into the specified number of shards, assigning
+    the samples round robin.
+
+    @param path: The training data, one "label features" sample per line,
+                 or a dataset written by tools/binfmt.py.
+    @param count: The number of shards.
+    @return: A list of (labels, features) tuples.
+    """
+    if os.path.isdir(path):
+        labels, data = open_dataset(path)
+        features = transform(data)
+        return [(labels[i::count], features[i::count]) for i in xrange(count)]
+
+    labels   = []
+    features = []
+    with open(path, "r") as fp:
+        for (y, x) in textparse.labelled(fp, BLOCK_SIZE):
+            labels.append(y)
+            features.append(transform(x))
+
+    labels   = np.concatenate(labels)
+    features = np.concatenate(features)
+    return [(labels[i::count], features[i::count]) for i in xrange(count)]
+
+def epoch(task):
+    """
+    Trains the model of a shard for one epoch, warm started from the mixed
+    model.
+
+    @param task: A (shard, coef, intercept, t, seed) tuple, where t is the
+                 step counter of the learning rate schedule.
+    @return: A (samples, coef, intercept, t) tuple of the trained model.
+    """
+    (shard, coef, intercept, t, seed) = task
+    (labels, features) = SHARDS[shard]
+
+    clf = LM.SGDClassifier(loss='hinge', random_state=seed)
+    if coef is not None:
+        # partial_fit continues from the existing parameters and schedule.
+        clf.coef_      = coef.reshape(1, -1).copy()
+        clf.intercept_ = np.array([intercept])
+        clf.t_         = t
+    clf.partial_fit(features, labels, classes=CLASSES)
+
+    return (len(labels), clf.coef_.ravel(), clf.intercept_[0], clf.t_)
+
+def mix(models):
+    """
+    Averages the models of the shards, weighted by their number of samples.
+
+    @return: A (coef, intercept, t) tuple of the mixed model.
+    """
+    counts     = [m[0] for m in models]
+    coef       = average(((1, n, c) for (n, c, _, _) in models), 'samples')
+    intercept  = np.average([m[2] for m in models], weights=counts)
+    t          = np.average([m[3] for m in models], weights=counts)
+    return (coef, intercept, t)
+
+def accuracy(coef, data, labels):
+    """
+    Computes the accuracy of the weights on a test set, as evaluate.py does.
+    """
+    from evaluate import binary_blocks, text_blocks
+
+    blocks = binary_blocks if os.path.isdir(data) else text_blocks
+
+    correct = 0
+    total   = 0
+    for (y, x) in blocks(data, labels, BLOCK_SIZE):
+        correct += np.sum(y*transform(x).dot(coef) >= 0)
+        total   += len(y)
+
+    return float(correct) / total
+
+def train(pool, shards, tolerance, max_epochs, test=None):
+    """
+    Runs epochs of parameter mixing until the relative change of the
+    weights drops below the tolerance.
+
+    @param test: An optional (data, labels) tuple to report the accuracy of
+                 every epoch on.
+    @return: The coefficients of the mixed model.
+    """
+    coef      = None
+    intercept = 0.0
+    t         = 1.0
+
+    for i in xrange(max_epochs):
+        tasks  = [(s, coef, intercept, t, i) for s in xrange(shards)]
+        models = pool.map(epoch, tasks)
+        (mixed, intercept, t) = mix(models)
+
+        change = np.inf
+        if coef is not None:
+            change = (np.linalg.norm(mixed - coef) /
+                      max(np.linalg.norm(coef), 1e-12))
+        coef = mixed
+
+        message = "epoch %d: change %g" % (i + 1, change)
+        if test is not None:
+            message += ", accuracy %f" % accuracy(coef, *test)
+        logging.info(message)
+
+        if change < tolerance:
+            break
+
+    return coef
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    parser = argparse.ArgumentParser(description="Trains the SVM with "
+                                     "iterative parameter mixing")
+    parser.add_argument('training', help="the training data")
+    parser.add_argument('--shards', type=int,
+                        help="the number of models mixed (default: --jobs)")
+    parser.add_argument('--jobs', type=int,
+                        default=multiprocessing.cpu_count(),
+                        help="the number of worker processes")
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE,
+                        help="the relative change of the weights to stop at")
+    parser.add_argument('--max-epochs', type=int, default=MAX_EPOCHS,
+                        help="the maximum number of epochs")
+    parser.add_argument('--test', nargs=2, metavar=('DATA', 'LABELS'),
+                        help="report the accuracy on a test set every epoch")
+    args = parser.parse_args()
+
+    shards = args.shards or args.jobs
+    SHARDS.extend(load(args.training, shards))
+
+    pool = multiprocessing.Pool(args.jobs)
+    try:
+        coef = train(pool, shards, args.tolerance, args.max_epochs, args.test)
+    finally:
+        pool.close()
+        pool.join()
+
+    emit(coef)
@@ -1,22 +1,90 @@
 #!/local/anaconda/bin/python
 # IMPORTANT: leave the above line as is.
 
+import argparse
+import base64
+import os
 import sys
+import threading
+import Queue
 import numpy as np
-import 0sklearn
-from sklearn import preprocessing as PP
 from sklearn import linear_model  as LM
 
+# The parsers and formats shared by all projects.
+TOOLS = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..',
+                     'tools')
+sys.path.append(TOOLS)
+import textparse
+
 DIMENSION = 400  # Dimension of the original data.
 CLASSES = (-1, +1)   # The classes that we are trying to predict.
 
-# Emit an array of coefficient representing the model built on the current mapper
-def emit(coef):
- string=' '.join(str(x) for x in coef)
- print("%s, %s" % (1, string))
-    #return coef
+# The feature map, selected with the SVM_FEATURES environment variable so
+# that evaluate.py, which imports transform, uses the same map as the
+# mappers. The random maps are drawn from FEATURE_SEED (SVM_FEATURE_SEED).
+#  poly:  the degree 2 polynomial features of the columns in TAKE, without
+#         the bias and in the order of PP.PolynomialFeatures: the columns
+#         followed by the products of all column pairs (i, j) with i <= j.
+#  rff:   RFF_COMPONENTS random Fourier features of the RBF kernel
+#         exp(-RFF_GAMMA*|x - y|^2) on all dimensions.
+#  cross: all dimensions followed by CROSS_BUCKETS hashed feature crosses,
+#         the products of two signed count sketches of the sample, whose
+#         inner products approximate the degree 2 polynomial kernel.
+FEATURE_MAPS = ('poly', 'rff', 'cross')
+FEATURE_MAP = os.environ.get('SVM_FEATURES', 'poly')
+FEATURE_SEED = int(os.environ.get('SVM_FEATURE_SEED', 42))
+
+TAKE = [5, 20, 27, 31, 40, 41, 61, 249, 347]
+PAIRS = np.array([(i, j) for i in range(len(TAKE)) for j in range(i, len(TAKE))])
+
+RFF_COMPONENTS = 2048
+RFF_GAMMA = float(os.environ.get('SVM_GAMMA', 100.0))  # ~1/median |x - y|^2.
+
+CROSS_BUCKETS = 1024
+
+if FEATURE_MAP not in FEATURE_MAPS:
+  raise ValueError("Unknown feature map: %s" % FEATURE_MAP)
+
+# The projection of the random maps, applied with a single matrix multiply.
+rng = np.random.RandomState(FEATURE_SEED)
+if FEATURE_MAP == 'poly':
+  FEATURES = len(TAKE) + len(PAIRS)
+elif FEATURE_MAP == 'rff':
+  FEATURES = RFF_COMPONENTS
+  PROJECTION = rng.normal(scale=np.sqrt(2*RFF_GAMMA),
+                          size=(DIMENSION, RFF_COMPONENTS))
+  OFFSETS = rng.uniform(0, 2*np.pi, size=RFF_COMPONENTS)
+else:
+  FEATURES = DIMENSION + CROSS_BUCKETS
+  # Both sketches side by side: dimension i is added with a random sign to
+  # a random bucket of each.
+  PROJECTION = np.zeros((DIMENSION, 2*CROSS_BUCKETS))
+  for sketch in xrange(2):
+    buckets = rng.randint(CROSS_BUCKETS, size=DIMENSION)
+    signs = rng.choice([-1.0, 1.0], size=DIMENSION)
+    PROJECTION[np.arange(DIMENSION), sketch*CROSS_BUCKETS + buckets] = signs
+del rng
+
+BATCH_SIZE = 1024  # Samples per minibatch in the streaming mode.
+PREFETCH = 2       # Minibatches parsed ahead of the training.
 
-def sgd_train(features,labels):
+BINARY_PREFIX = "b64:"  # Marks base64 encoded little endian doubles.
+
+# Encode the coefficients as text, or as binary if requested
+def encode_coefficients(coef, binary=False):
+  if binary:
+    data = np.asarray(coef, dtype='<f8').tostring()
+    return BINARY_PREFIX + base64.b64encode(data)
+  return ' '.join(str(x) for x in coef)
+
+# Emit an array of coefficient representing the model built on the current
+# mapper, with the number of samples it was trained on so that the reducer
+# can weight it
+def emit(coef, samples, binary=False):
+ string = encode_coefficients(coef, binary)
+ print("%s, %d %d|%s" % (1, 1, samples, string))
+
+def sgd_train(features,labels,binary=False):
 
   X = features
   y = labels
@@ -26,32 +94,138 @@ def sgd_train(features,labels):
   clf.fit(X, y)
   coef = clf.coef_
   coef = [val for sublist in coef for val in sublist]
-  emit(coef)
-
-def transform(x_original):
-  take = [5, 20, 27, 31, 40, 41, 61, 249, 347]
-  newx = [x_original[i] for i in take]
-  t = PP.PolynomialFeatures(degree=2)
-  x = t.fit_transform([newx])
-  return x.flatten()[1:]
-   
-if __name__ == "__main__":
+  emit(coef, len(y), binary)
+
+# Read the samples in minibatches of at most size samples on a separate
+# thread, so that parsing overlaps with the training. Each minibatch is
+# parsed into one of PREFETCH + 1 preallocated buffers, which is handed
+# back to the reader once the next minibatch is requested, so the memory
+# does not depend on the size of the input. An error of the reader is
+# raised again by the consumer.
+def read_batches(stream, size):
+  free = Queue.Queue()
+  full = Queue.Queue()
+  errors = []
+  for _ in xrange(PREFETCH + 1):
+    free.put((np.empty(size), np.empty((size, FEATURES))))
 
-  train_set=[]
-  train_labels=[]
+  def reader():
+    try:
+      for batch_labels, data in textparse.labelled(stream, size):
+        labels, features = free.get()
+        n = len(batch_labels)
+        labels[:n] = batch_labels
+        transform(data, out=features[:n])
+        full.put((labels, features, n))
+    except Exception:
+      errors.append(sys.exc_info())
+    finally:
+      full.put(None)
 
-  for line in sys.stdin:
+  thread = threading.Thread(target=reader)
+  thread.daemon = True
+  thread.start()
 
-    line = line.strip()
-    (label, x_string) = line.split(" ", 1)
-    label = int(label)
-    x_original = np.fromstring(x_string, sep=' ')
+  while True:
+    batch = full.get()
+    if batch is None:
+      break
+    labels, features, n = batch
+    yield labels[:n], features[:n]
+    free.put((labels, features))
+  thread.join()
+
+  if errors:
+    error_type, error, trace = errors[0]
+    raise error_type, error, trace
+
+# Read the samples from a dataset written by tools/binfmt.py, optionally
+# only those in a byte range of its features.
+def open_dataset(path, byte_range=None):
+  import binfmt
+
+  dataset, first, last = binfmt.open_range(path, byte_range)
+  labels = dataset.column('labels')[first:last]
+  data = dataset.column('features')[first:last]
+  return labels, data
+
+# Read the minibatches of a dataset. The samples are memory mapped, so
+# only the transformation needs a buffer.
+def read_binary_batches(path, byte_range, size):
+  labels, data = open_dataset(path, byte_range)
+  features = np.empty((size, FEATURES))
+  for start in xrange(0, len(labels), size):
+    end = min(start + size, len(labels))
+    yield labels[start:end], transform(data[start:end],
+                                       out=features[:end - start])
+
+# Train the classifier one minibatch at a time and emit its coefficients.
+def sgd_stream(batches, binary=False):
+  clf = LM.SGDClassifier(loss='hinge')
+  samples = 0
+  for labels, features in batches:
+    clf.partial_fit(features, labels, classes=CLASSES)
+    samples += len(labels)
+
+  if samples > 0:
+    emit(clf.coef_.ravel(), samples, binary)
+
+# Transform a single sample or a matrix with one sample per row. The
+# features of a matrix are written into out, if given, which must have
+# FEATURES columns.
+def transform(x_original, out=None):
+  x = np.atleast_2d(x_original)
+  if out is None:
+    out = np.empty((x.shape[0], FEATURES))
+
+  if FEATURE_MAP == 'poly':
+    cols = x[:, TAKE]
+    out[:, :len(TAKE)] = cols
+    np.multiply(cols[:, PAIRS[:, 0]], cols[:, PAIRS[:, 1]], out=out[:, len(TAKE):])
+  elif FEATURE_MAP == 'rff':
+    np.dot(x, PROJECTION, out=out)
+    out += OFFSETS
+    np.cos(out, out=out)
+    out *= np.sqrt(2.0/RFF_COMPONENTS)
+  else:
+    sketches = np.dot(x, PROJECTION)
+    out[:, :DIMENSION] = x
+    np.multiply(sketches[:, :CROSS_BUCKETS], sketches[:, CROSS_BUCKETS:],
+                out=out[:, DIMENSION:])
+
+  if np.ndim(x_original) == 1:
+    return out[0]
+  return out
+   
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="SVM mapper")
+  parser.add_argument('--stream', action='store_true',
+                      help="train on minibatches with constant memory")
+  parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                      help="the number of samples in a minibatch")
+  parser.add_argument('--binary', action='store_true',
+                      help="emit the coefficients in binary")
+  parser.add_argument('--dataset', metavar='PATH',
+                      help="read the samples from a binary dataset")
+  parser.add_argument('--range', metavar='START:END',
+                      help="only read this byte range of the dataset")
+  args = parser.parse_args()
 
+  if args.stream:
+    if args.dataset:
+      batches = read_binary_batches(args.dataset, args.range, args.batch_size)
+    else:
+      batches = read_batches(sys.stdin, args.batch_size)
+    sgd_stream(batches, args.binary)
+    sys.exit(0)
 
-    # create a vector of feature
-    train_set.append(x_original)
-    train_labels.append(label)
+  if args.dataset:
+    labels, data = open_dataset(args.dataset, args.range)
+    sgd_train(transform(data), labels, args.binary)
+    sys.exit(0)
 
-  # train our model on the features
-  train_set_trans = transform(train_set)
-  sgd_train(train_set_trans, train_labels)
+  # Parse the whole input in chunks and train our model on the features
+  chunks = list(textparse.labelled(sys.stdin))
+  train_labels = np.concatenate([labels for labels, _ in chunks])
+  train_set_trans = transform(np.concatenate([data for _, data in chunks]))
+  sgd_train(train_set_trans, train_labels, args.binary)
@@ -1,26 +1,117 @@
 #!/local/anaconda/bin/python
 # IMPORTANT: leave the above line as is.
 
+import argparse
+import base64
 import logging
 import sys
 import numpy as np
 
-lines = 0
-avgs = None
+# A record is "key, coefficients" for a single model, or "key, models|
+# coefficients" or "key, models samples|coefficients" for the mean of
+# models models trained on samples samples in total. The coefficients are
+# either text or, after BINARY_PREFIX, the base64 encoding of little
+# endian doubles.
+BINARY_PREFIX = "b64:"
+WEIGHTS = ('models', 'samples')  # What the models can be weighted by.
 
-for line in sys.stdin:
-    line = line.strip()
-    k, v = line.split(', ')
-    coef = np.fromstring(v, sep=" ",dtype='double')
-    if avgs is None:
-        avgs = np.zeros(coef.size)
+def decode_coefficients(string):
+    """
+    Decodes the text or binary coefficients of a record.
+    """
+    if string.startswith(BINARY_PREFIX):
+        return np.frombuffer(base64.b64decode(string[len(BINARY_PREFIX):]),
+                             dtype='<f8')
+    return np.fromstring(string, sep=" ",dtype='double')
 
-    lines += 1
-    for i in xrange(0, coef.size):
-      avgs[i] += coef[i]
+def parse(value):
+    """
+    Parses the value of a record.
 
-for i in xrange(0, avgs.size):
-   avgs[i] /= lines
+    @return: A (models, samples, coefficients) tuple, where samples is None
+             if the record does not hold the number of samples.
+    """
+    models  = 1
+    samples = None
+    if '|' in value:
+        header, value = value.split('|')
+        header  = header.split()
+        models  = int(header[0])
+        if len(header) > 1:
+            samples = int(header[1])
 
-list = avgs.tolist()
-print(' '.join([str(f) for f in list]))
+    return (models, samples, decode_coefficients(value))
+
+def read_records(stream):
+    """
+    Reads the mapper records, yielding their parsed values.
+    """
+    for line in stream:
+        line = line.strip()
+        if not line:
+            continue
+        k, v = line.split(', ')
+        yield parse(v)
+
+class Accumulator(object):
+    """
+    Accumulates the weighted mean of the coefficients of models.
+    """
+    def __init__(self, weight='models'):
+        """
+        @param weight: 'models' to weight every model equally, 'samples' to
+                       weight it by the number of samples it was trained on.
+        """
+        self.weight  = weight
+        self.models  = 0
+        self.samples = 0
+        self.total   = None
+        self.weights = 0
+
+    def add(self, models, samples, coef):
+        """
+        Adds a record holding the mean coefficients of models models.
+        """
+        if samples is None:
+            if self.weight == 'samples':
+                raise ValueError("the record has no number of samples")
+            self.samples = None
+        elif self.samples is not None:
+            self.samples += samples
+
+        w = models if self.weight == 'models' else samples
+        self.models  += models
+        self.weights += w
+        if self.total is None:
+            self.total = coef*w
+        else:
+            self.total += coef*w
+
+    def mean(self):
+        return self.total/self.weights
+
+def average(records, weight='models'):
+    """
+    Averages the coefficients of the (models, samples, coefficients)
+    records.
+    """
+    accumulator = Accumulator(weight)
+    for (models, samples, coef) in records:
+        accumulator.add(models, samples, coef)
+    return accumulator.mean()
+
+def emit(avgs):
+    list = avgs.tolist()
+    print(' '.join([str(f) for f in list]))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="SVM reducer")
+    parser.add_argument('--weight', choices=WEIGHTS, default='models',
+                        help="weight the models equally or by their samples")
+    args = parser.parse_args()
+
+    try:
+        emit(average(read_records(sys.stdin), args.weight))
+    except ValueError as e:
+        logging.error("Cannot weight by samples: %s" % e)
+        sys.exit(1)
@@ -1,25 +1,33 @@
+import itertools
 import sys
 import numpy as np
 
 sys.path.append(sys.argv[4])
 from mapper import transform
 
+BLOCK_SIZE = 4096  # Samples labelled at once.
+
 if __name__ == "__main__":
    with open(sys.argv[1], "r") as weights_file:
       weights = np.genfromtxt(weights_file).flatten()
 
    with open(sys.argv[2], "r") as data_file:
       with open(sys.argv[3], "w") as pred_file:
-         for x_string in data_file:
-            # Apply the transformation for x and then continue.
-            # Compute the label and write it to the prediction file.
-            x_o = np.fromstring(x_string, sep=' ')
-            x_t = transform(x_o)
+         first = True
+         while True:
+            x_strings = list(itertools.islice(data_file, BLOCK_SIZE))
+            if not x_strings:
+               break
+
+            # Apply the transformation for the whole block and then continue.
+            # Compute the labels and write them to the prediction file.
+            x_o = np.fromstring(' '.join(x_strings), sep=' ')
+            x_t = transform(x_o.reshape(len(x_strings), -1))
 
-            print("WEIGHTS: %s"%(weights.shape))
-            print("VALUES:  %s"%(x_t.shape))
+            if first:
+               print("WEIGHTS: %s"%(weights.shape))
+               print("VALUES:  %s"%(x_t.shape[1:]))
+               first = False
 
-            if np.inner(weights, x_t) > 0:
-               pred_file.write("-1\n")
-            else:
-               pred_file.write("+1\n")
+            labels = np.where(x_t.dot(weights) > 0, "-1\n", "+1\n")
+            pred_file.write(''.join(labels))
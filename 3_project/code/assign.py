@@ -0,0 +1,106 @@
+import numpy as np
+
+# ASSIGNMENT
+#----------------------------------------------------------
+# Assigns points to their nearest centers a block at a time. The squared
+# distances are expanded as |x|^2 - 2 x.c + |c|^2, so that scoring a block
+# against all centers is a single matrix multiplication. The squared norms
+# of the centers are computed once per set of centers.
+#
+# The distances can be computed in float32, which halves the memory traffic
+# of the points and runs the multiplication in single precision. The sums
+# of the points are always accumulated in float64.
+
+BLOCK_POINTS = 4096  # Points scored against the centers at once.
+DTYPES       = {'float64': np.float64, 'float32': np.float32}
+DIGITS       = {'float64': None, 'float32': 7}  # Digits printed per value.
+
+def format_point(point, dtype='float64'):
+    """
+    Formats a point as a line of text. float64 values are printed with
+    str, float32 values with the 7 significant digits they hold.
+    """
+    if DIGITS[dtype] is None:
+        return ' '.join([str(f) for f in point])
+
+    fmt = '%%.%dg' % DIGITS[dtype]
+    return ' '.join([fmt % f for f in point])
+
+class Assigner(object):
+
+    def __init__(self, centers, dtype=np.float64):
+        self.dtype = dtype
+        self.update(centers)
+
+    def update(self, centers):
+        """
+        Sets the centers and caches their squared norms.
+        """
+        self.centers = np.ascontiguousarray(centers, dtype=self.dtype)
+        self.norms   = np.einsum('ij,ij->i', self.centers, self.centers)
+
+    def distances(self, points):
+        """
+        Returns the squared distances of a block of points to all centers.
+        """
+        points    = np.asarray(np.atleast_2d(points), dtype=self.dtype)
+        distances = np.dot(points, self.centers.T)
+        distances *= -2
+        distances += self.norms
+        distances += np.einsum('ij,ij->i', points, points)[:, np.newaxis]
+
+        # The expansion may round slightly negative for very close points.
+        return np.maximum(distances, 0, out=distances)
+
+    def assign(self, points):
+        """
+        Assigns the points to their nearest centers.
+
+        @return: A (indices, squared distances) tuple holding the index of
+                 the nearest center of every point and its squared distance.
+        """
+        points    = np.atleast_2d(points)
+        indices   = np.empty(len(points), dtype=int)
+        distances = np.empty(len(points), dtype=self.dtype)
+
+        for start in xrange(0, len(points), BLOCK_POINTS):
+            block = self.distances(points[start:start + BLOCK_POINTS])
+            end   = start + len(block)
+
+            indices[start:end]   = block.argmin(axis=1)
+            distances[start:end] = block[np.arange(len(block)),
+                                         indices[start:end]]
+
+        return (indices, distances)
+
+def accumulate(points, indices, count, weights=None):
+    """
+    Sums the (weighted) points assigned to each center.
+
+    @param points:  The points.
+    @param indices: The index of the center of every point.
+    @param count:   The number of centers.
+    @param weights: The weights of the points, or None for unit weights.
+
+    @return: A (sums, counts) tuple holding the sum of the points and the
+             total weight of every center.
+    """
+    points = np.atleast_2d(points)
+    counts = np.bincount(indices, weights=weights, minlength=count)
+    sums   = np.zeros((count, points.shape[1]))
+
+    if len(points) == 0:
+        return (sums, counts)
+
+    # Sum the contiguous runs of the points sorted by center.
+    order   = np.argsort(indices, kind='mergesort')
+    ordered = points[order]
+    if weights is not None:
+        ordered = ordered*np.asarray(weights, dtype=float)[order, np.newaxis]
+
+    centers = indices[order]
+    starts  = np.flatnonzero(np.r_[True, centers[1:] != centers[:-1]])
+    sums[centers[starts]] = np.add.reduceat(ordered, starts, axis=0,
+                                            dtype=np.float64)
+
+    return (sums, counts)
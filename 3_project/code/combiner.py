@@ -0,0 +1,50 @@
+#!/local/anaconda/bin/python
+# IMPORTANT: leave the above line as is.
+
+import argparse
+import sys
+import numpy as np
+
+from assign import DTYPES, format_point
+
+# The combiner merges the partial means a mapper emitted for the same
+# center into a single mean weighted by the counts, i.e. the reducer sees
+# one "(index, count|mean)" record per center and mapper output.
+
+def emit(key, count, total):
+    mean = total/max(count, 1)
+    mstr = format_point(mean, args.dtype)
+
+    print("(%d, %d|%s)" % (key, count, mstr))
+
+parser = argparse.ArgumentParser(description="K-means combiner")
+parser.add_argument('--dtype', choices=sorted(DTYPES), default='float64',
+                    help="float32 prints the means with 7 digits")
+args = parser.parse_args()
+
+curr_key = None
+count    = 0
+total    = None
+
+for line in sys.stdin:
+    line        = line.strip()
+    line        = line.lstrip('(')
+    line        = line.rstrip(')')
+    key, vals   = line.split(', ')
+    cnt, vals   = vals.split('|')
+
+    key  = int(key)
+    cnt  = int(cnt)
+    inpt = np.fromstring(vals, sep=' ')
+
+    if key != curr_key and curr_key is not None:
+        emit(curr_key, count, total)
+        count = 0
+        total = None
+
+    curr_key = key
+    count   += cnt
+    total    = inpt*cnt if total is None else total + inpt*cnt
+
+if curr_key is not None:
+    emit(curr_key, count, total)
@@ -0,0 +1,280 @@
+#!/local/anaconda/bin/python
+# IMPORTANT: leave the above line as is.
+
+# Runs Lloyd's algorithm as a sequence of MapReduce jobs on the local
+# machine. Every round broadcasts the current centers file to the mappers,
+# combiners and the reducer with --centers, and the centers written by the
+# reducer are the centers of the next round. The rounds stop once no center
+# moves by more than the tolerance.
+#
+# With --checkpoint DIR the centers of every round are kept in DIR, and
+# --resume continues from the last round found there.
+#
+# With --dtype float32 every round first checks on the sample that the
+# float32 step is as good as the float64 step. If it is not, that round and
+# all later rounds run in float64, unless --allow-dtype-drift is given.
+
+import argparse
+import logging
+import os
+import pipes
+import random
+import shutil
+import sys
+import tempfile
+import time
+import numpy        as np
+
+from assign import DTYPES, Assigner, accumulate
+from seeding import random_centers
+
+# CONSTANTS
+#----------------------------------------------------------
+FEATURES        = 500
+CENTER_COUNT    = 100
+TOLERANCE       = 1e-3  # Largest center movement at which to stop.
+MAX_ROUNDS      = 100   # Upper bound on the number of rounds.
+SAMPLE          = 10000 # Points the quantization error is estimated on.
+SEED            = 42
+DTYPE_TOLERANCE = 1e-3  # Relative error increase allowed over float64.
+CHECKPOINT      = 'centers-%04d.txt'
+HERE            = os.path.dirname(os.path.abspath(__file__))
+TOOLS           = os.path.join(HERE, '..', '..', 'tools')
+
+sys.path.append(TOOLS)
+import mapreduce
+import textparse
+
+# CENTERS
+#----------------------------------------------------------
+
+def read_centers(path):
+    with open(path, "r") as inf:
+        return np.concatenate(list(textparse.dense(inf)))
+
+def write_centers(centers, path):
+    """
+    Writes the centers to a file, replacing it only once it is complete.
+    """
+    with open(path + '.tmp', "w") as outf:
+        for center in centers:
+            outf.write(' '.join([str(f) for f in center]) + '\n')
+    os.rename(path + '.tmp', path)
+
+def last_checkpoint(directory):
+    """
+    Finds the last round in a checkpoint directory.
+
+    @return: A (round, path) tuple, or (0, None) if there is none.
+    """
+    rounds = []
+    for name in os.listdir(directory):
+        try:
+            rounds.append(int(name[len('centers-'):-len('.txt')]))
+        except ValueError:
+            continue
+
+    if not rounds:
+        return (0, None)
+
+    return (max(rounds), os.path.join(directory, CHECKPOINT % max(rounds)))
+
+# SAMPLE
+#----------------------------------------------------------
+
+def sample_points(inputs, size, seed=SEED):
+    """
+    Draws about size points from the input files, by reading the line
+    after size random byte offsets, without reading the files in full.
+    """
+    rng     = random.Random(seed)
+    sizes   = [os.path.getsize(path) for path in inputs]
+    total   = sum(sizes)
+    offsets = sorted(rng.randrange(total) for _ in xrange(size)) \
+              if total > 0 else []
+
+    points  = []
+    base    = 0
+    for path, length in zip(inputs, sizes):
+        with open(path, "r") as inf:
+            for offset in offsets:
+                if not base <= offset < base + length:
+                    continue
+                inf.seek(offset - base)
+                inf.readline()
+                line = inf.readline()
+                if line.strip():
+                    points.append(line)
+        base += length
+
+    return textparse.parse_dense(points) if points else np.zeros((0, 0))
+
+def quantization_error(centers, sample, dtype='float64'):
+    """
+    The mean squared distance of the sample points to their nearest center,
+    as computed by evaluate.py on the full data.
+    """
+    if len(sample) == 0:
+        return np.nan
+
+    _, distances = Assigner(centers, DTYPES[dtype]).assign(sample)
+    return distances.mean(dtype=np.float64)
+
+def sample_step(centers, sample, dtype):
+    """
+    Runs the Lloyd step of a round on the sample, in the type the round
+    computes its distances in. In float32 the new centers are rounded to
+    float32, close to the 7 digits the round prints them with.
+    """
+    indices, _   = Assigner(centers, DTYPES[dtype]).assign(sample)
+    sums, counts = accumulate(sample, indices, len(centers))
+    filled       = counts > 0
+    moved        = np.array(centers, dtype=np.float64)
+    moved[filled] = sums[filled]/counts[filled, np.newaxis]
+    if dtype != 'float64':
+        moved = moved.astype(DTYPES[dtype]).astype(np.float64)
+    return moved
+
+def check_dtype(centers, sample, dtype):
+    """
+    Compares the reduced precision step of a round with the float64 step
+    from the same centers. Both steps run on the sample and are scored on
+    it in float64, as centers fitted to the sample score better on it
+    than the centers of the round, which are fitted to all points.
+
+    @return: False if the reduced precision error exceeds the float64
+             error by more than DTYPE_TOLERANCE, True otherwise.
+    """
+    if dtype == 'float64' or len(sample) == 0:
+        return True
+
+    reference = quantization_error(sample_step(centers, sample, 'float64'),
+                                   sample)
+    error     = quantization_error(sample_step(centers, sample, dtype),
+                                   sample)
+    if error - reference > DTYPE_TOLERANCE*reference:
+        logging.warning("%s step error %f exceeds the float64 step error "
+                        "%f by more than %g", dtype, error, reference,
+                        DTYPE_TOLERANCE)
+        return False
+
+    return True
+
+# ROUNDS
+#----------------------------------------------------------
+
+def lloyd_round(inputs, centers, output, mappers, dtype):
+    """
+    Runs one Lloyd step as a MapReduce job starting from a centers file.
+    """
+    arguments = '--centers %s --dtype %s' % (
+        pipes.quote(os.path.abspath(centers)), dtype)
+
+    mapreduce.run(os.path.join(HERE, 'mapper.py'),
+                  os.path.join(HERE, 'reducer.py'), inputs, output,
+                  mapper_args=arguments, reducer_args=arguments,
+                  combiner=os.path.join(HERE, 'combiner.py'),
+                  combiner_args='--dtype %s' % dtype,
+                  mappers=mappers, reducers=1, log=None)
+
+def run(inputs, output, centers, directory, resume, tolerance, max_rounds,
+        sample, mappers, dtype='float64', allow_drift=False):
+    """
+    Runs rounds until the centers converge, keeping the centers of every
+    round in the checkpoint directory. A reduced precision dtype falls back
+    to float64 once its step fails check_dtype, unless allow_drift is set.
+
+    @return: The final centers.
+    """
+    first = 0
+    if resume:
+        first, path = last_checkpoint(directory)
+        if path is not None:
+            centers = read_centers(path)
+            logging.info("resuming after round %d", first)
+
+    current = os.path.join(directory, CHECKPOINT % first)
+    if not os.path.exists(current):
+        write_centers(centers, current)
+
+    logging.info("round %d: error %f", first,
+                 quantization_error(centers, sample))
+
+    for index in xrange(first + 1, max_rounds + 1):
+        start = time.time()
+        path  = os.path.join(directory, CHECKPOINT % index)
+
+        if not check_dtype(centers, sample, dtype) and not allow_drift:
+            logging.warning("running round %d and later rounds in float64",
+                            index)
+            dtype = 'float64'
+
+        lloyd_round(inputs, current, path + '.tmp', mappers, dtype)
+        os.rename(path + '.tmp', path)
+
+        moved   = read_centers(path)
+        shift   = np.sqrt(((moved - centers)**2).sum(axis=1)).max()
+        centers = moved
+        current = path
+
+        logging.info("round %d: moved %g, error %f, %.1fs", index, shift,
+                     quantization_error(centers, sample), time.time() - start)
+
+        if shift <= tolerance:
+            break
+
+    write_centers(centers, output)
+    return centers
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    parser = argparse.ArgumentParser(description="Runs k-means as repeated "
+                                     "MapReduce jobs")
+    parser.add_argument('input', nargs='+', help="the points, one per line")
+    parser.add_argument('--output', required=True,
+                        help="the file to write the final centers to")
+    parser.add_argument('--centers', metavar='FILE',
+                        help="the initial centers, e.g. seeded by "
+                             "seeding.py (default: the random centers of "
+                             "mapper.py)")
+    parser.add_argument('--checkpoint', metavar='DIR',
+                        help="keep the centers of every round in DIR")
+    parser.add_argument('--resume', action='store_true',
+                        help="continue after the last round in --checkpoint")
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE,
+                        help="the center movement to stop at")
+    parser.add_argument('--max-rounds', type=int, default=MAX_ROUNDS,
+                        help="the maximum number of rounds")
+    parser.add_argument('--sample', type=int, default=SAMPLE,
+                        help="the points to estimate the error on")
+    parser.add_argument('--mappers', type=int, default=None,
+                        help="parallel processes (default: all cores)")
+    parser.add_argument('--dtype', choices=sorted(DTYPES), default='float64',
+                        help="compute the distances in this type; float32 "
+                             "also passes the centers with 7 digits")
+    parser.add_argument('--allow-dtype-drift', action='store_true',
+                        help="keep the --dtype even when its step is worse "
+                             "than the float64 step on the sample")
+    args = parser.parse_args()
+
+    if args.resume and not args.checkpoint:
+        parser.error("--resume requires --checkpoint")
+
+    if args.centers:
+        centers = read_centers(args.centers)
+    else:
+        centers = random_centers(CENTER_COUNT, FEATURES)
+
+    sample    = sample_points(args.input, args.sample)
+    directory = args.checkpoint or tempfile.mkdtemp(prefix='kmeans-')
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    try:
+        run(args.input, args.output, centers, directory, args.resume,
+            args.tolerance, args.max_rounds, sample, args.mappers,
+            args.dtype, args.allow_dtype_drift)
+    finally:
+        if not args.checkpoint:
+            shutil.rmtree(directory, ignore_errors=True)
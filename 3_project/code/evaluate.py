@@ -1,25 +1,159 @@
+import argparse
 import logging
+import multiprocessing
+import os
 import sys
 import numpy as np
-from sklearn.metrics.pairwise import pairwise_distances
+
+from assign import BLOCK_POINTS, Assigner
+
+TOOLS = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..',
+                     'tools')
+sys.path.append(TOOLS)
+import mapreduce
+import textparse
+
+# The test points are read and scored a block at a time, so the memory
+# used does not grow with the test set. With --jobs the test set is split
+# into byte ranges that are scored in parallel, and the squared distances
+# are summed per cluster.
+
+# The centers, set before the pool is created, so that the worker processes
+# inherit them instead of receiving them with every task.
+CENTERS = []
+
+def read_points(path):
+    """
+    Reads the points from a text file, or memory maps them from a
+    dataset written by tools/binfmt.py.
+    """
+    if os.path.isdir(path):
+        import binfmt
+        return binfmt.Dataset(path).column('points')
+
+    with open(path, "r") as fp_points:
+        return np.concatenate(list(textparse.dense(fp_points)))
+
+class RangeReader(object):
+    """
+    Reads a byte range of a file like a stream.
+    """
+    def __init__(self, path, start, end):
+        self.inf       = open(path, "r")
+        self.remaining = end - start
+        self.inf.seek(start)
+
+    def read(self, size):
+        data = self.inf.read(min(size, self.remaining))
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.inf.close()
+
+def split(path, jobs):
+    """
+    Splits the test points into about jobs byte ranges, at line boundaries
+    for text files.
+
+    @return: A list of (path, start, end) tuples.
+    """
+    if os.path.isdir(path):
+        import binfmt
+        size  = binfmt.Dataset(path).size()
+        step  = max(-(-size // jobs), 1)
+        return [(path, start, min(start + step, size))
+                for start in xrange(0, size, step)]
+
+    size = os.path.getsize(path)
+    return mapreduce.splits(path, max(-(-size // jobs), 1))
+
+def blocks(path, start, end):
+    """
+    Reads the blocks of points in a byte range of the test points.
+    """
+    if os.path.isdir(path):
+        import binfmt
+        dataset, first, last = binfmt.open_range(path, "%d:%d" % (start, end))
+        points = dataset.column('points')
+        for begin in xrange(first, last, BLOCK_POINTS):
+            yield points[begin:min(begin + BLOCK_POINTS, last)]
+        return
+
+    stream = RangeReader(path, start, end)
+    try:
+        for chunk in textparse.dense(stream, BLOCK_POINTS):
+            yield chunk
+    finally:
+        stream.close()
+
+def score(task):
+    """
+    Sums the squared distances of the points in a byte range to their
+    nearest centers.
+
+    @param task: A (path, start, end) tuple.
+    @return: A (errors, sizes) tuple with the sum of the squared distances
+             and the number of the points of every center.
+    """
+    assigner = Assigner(CENTERS)
+    errors   = np.zeros(len(CENTERS))
+    sizes    = np.zeros(len(CENTERS), dtype=np.int64)
+
+    for points in blocks(*task):
+        indices, distances = assigner.assign(points)
+        errors += np.bincount(indices, weights=distances,
+                              minlength=len(CENTERS))
+        sizes  += np.bincount(indices, minlength=len(CENTERS))
+
+    return (errors, sizes)
+
+def evaluate(path, jobs=1):
+    """
+    Scores the test points against CENTERS.
+
+    @return: An (errors, sizes) tuple as returned by score for all points.
+    """
+    tasks = split(path, jobs)
+    if jobs > 1 and len(tasks) > 1:
+        pool = multiprocessing.Pool(jobs)
+        try:
+            results = pool.map(score, tasks, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [score(task) for task in tasks]
+
+    errors = sum(r[0] for r in results) if results else np.zeros(len(CENTERS))
+    sizes  = sum(r[1] for r in results) if results else np.zeros(len(CENTERS))
+    return (errors, sizes)
 
 if __name__ == "__main__":
-    if not len(sys.argv) == 3:
-        logging.error("Usage: evaluate.py centers test_data")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(description="Computes the quantization "
+                                     "error of the centers on test points")
+    parser.add_argument('centers')
+    parser.add_argument('test_data')
+    parser.add_argument('--jobs', type=int, default=1,
+                        help="the number of worker processes")
+    parser.add_argument('--clusters', action='store_true',
+                        help="also print the size and the error of every "
+                             "cluster")
+    args = parser.parse_args()
 
-    with open(sys.argv[1], "r") as fp_centers:
-        centers = np.genfromtxt(fp_centers)
+    CENTERS = read_points(args.centers)
 
-    with open(sys.argv[2], "r") as fp_test_data:
-        points = np.genfromtxt(fp_test_data)
-                  
-    if centers.shape[0] != 100:
+    if CENTERS.shape[0] != 100:
         logging.error("Didn't return 100 centers.")
         sys.exit(1);
 
-    distances = pairwise_distances(points, centers, metric='sqeuclidean')
-    quant_error = distances.min(axis=1).sum()
-    quant_error /= points.shape[0]
-    
+    errors, sizes = evaluate(args.test_data, args.jobs)
+    quant_error = errors.sum()
+    quant_error /= max(sizes.sum(), 1)
+
     print "%.5f" % quant_error
+
+    if args.clusters:
+        for index in xrange(len(CENTERS)):
+            print "%d %d %.5f" % (index, sizes[index],
+                                  errors[index]/max(sizes[index], 1))
@@ -1,88 +1,117 @@
+import argparse
+import os
 import sys
 import numpy        as np
-import numpy.linalg as la
-import numpy.random as rng
 
-ITERATIONS = 5
+ITERATIONS = 100  # Upper bound, the iterations stop once no point moves.
 NUM_C = 100
+CORESET = 1000    # Default number of points of a coreset.
 NUM_F = 500
 MAX_F = sys.float_info.max
 MIN_F = sys.float_info.min
-
-def euclidean(x, y):
-    return la.norm(x - y, ord=2)
-
-def nearest(point, centers):
-    min_index       = 0
-    min_distance    = MAX_F
-
-    for i in xrange(0, centers.shape[0]):
-        distance = euclidean(centers[i], point)
-
-        if distance < min_distance:
-            min_distance = distance
-            min_index    = i
-
-    return min_index
-
-def kmeans(data, invariant):
-    # Sample centers in the range defined by the data.
-    data_min = data.min(axis=0)
-    data_max = data.max(axis=0)
-    data_rng = data_max - data_min
-
-    C = rng.rand(NUM_C, NUM_F)
-
-    for cIndex in xrange(0, NUM_C):
-        C[cIndex] *= data_rng
-        C[cIndex] += data_min
-
-    C_previous = np.zeros(C.shape)
-    C_change   = C - C_previous
-
-    # Iterate over the center until the invariant is met.
-    for i in xrange(0, invariant):
-        sys.stderr.write("Iteration: %d\n" % (i))
-        sys.stderr.flush()
-        
-        additions = np.zeros(C.shape)
-        counters  = np.zeros(C.shape[0])
-
-        for point in data:
-            center    = nearest(point, C)
-            direction = point - C[center]
-
-            additions[center] += direction
-            counters[center]  += 1
-
-        for center in xrange(0, C.shape[0]):
-            counter = counters[center]
-            counter = max(counter, 1)
-            addition = additions[center]
-            C[center] += addition/counter
+TOOLS = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..',
+                     '..', 'tools')
+sys.path.append(TOOLS)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import textparse
+from assign import BLOCK_POINTS, DTYPES, Assigner, format_point
+from lloyd import lloyd
+from seeding import SEED, kmeanspp, round_state
+
+def kmeans(data, invariant, dtype):
+    # Seed the centers with k-means++.
+    C = kmeanspp(data, NUM_C)
+
+    # Iterate until no point changes its center, at most invariant times.
+    C, counters, stats = lloyd(data, C, max_iterations=invariant,
+                               dtype=DTYPES[dtype])
+    sys.stderr.write("Iterations: %d, distances computed: %d, skipped: %d\n"
+                     % (stats['iterations'], stats['computed'],
+                        stats['skipped']))
+    sys.stderr.flush()
 
     return [C, counters]
 
-def emit(centers, counters):
+def coreset(data, size, dtype, rng):
+    # Importance sampling with the sensitivities of Bachem et al., Practical
+    # Coreset Constructions for Machine Learning, bounded with a k-means++
+    # clustering B: every point is drawn with probability proportional to
+    #   a*d(x,B)^2/c + 2a*cost(B_x)/(|B_x| c) + 4n/|B_x|,
+    # where B_x is the cluster of x, c the mean cost and a = 16(log k + 2),
+    # and weighted by the inverse of its expected number of draws, so the
+    # weights sum to n in expectation.
+    if len(data) <= size:
+        return [data, np.ones(len(data))]
+
+    B = kmeanspp(data, NUM_C, rng=rng)
+    indices, distances = Assigner(B, DTYPES[dtype]).assign(data)
+    distances = distances.astype(np.float64)
+
+    n      = len(data)
+    alpha  = 16*(np.log(NUM_C) + 2)
+    mean   = max(distances.mean(), MIN_F)
+    sizes  = np.bincount(indices, minlength=len(B)).astype(float)
+    costs  = np.bincount(indices, weights=distances, minlength=len(B))
+
+    sensitivity = (alpha*distances/mean
+                   + 2*alpha*costs[indices]/(sizes[indices]*mean)
+                   + 4*n/sizes[indices])
+    q = sensitivity/sensitivity.sum()
+
+    # Points drawn more than once are emitted once with the summed weight.
+    drawn, times = np.unique(rng.choice(n, size, p=q), return_counts=True)
+    weights = times/(size*q[drawn])
+    sys.stderr.write("Coreset: %d of %d points, weight %.1f\n"
+                     % (len(drawn), n, weights.sum()))
+    sys.stderr.flush()
+
+    return [data[drawn], weights]
+
+def emit(centers, counters, dtype):
     for index in xrange(0, centers.shape[0]):
         center  = centers[index]
         counter = counters[index]
-        string  = ' '.join([str(f) for f in center])
-
-        print("(1, %d|%s)" % (counter, string))
-
-
-# Read data from standard input.
-data = []
-for line in sys.stdin:
-    line  = line.strip()
-    point = np.fromstring(line, sep=' ')
-
-    data.append(point)
-data = np.array(data)
-
-# Apply Kmeans clustering.
-centers, counters = kmeans(data, ITERATIONS)
+        string  = format_point(center, dtype)
+
+        print("(1, %r|%s)" % (float(counter), string))
+
+
+parser = argparse.ArgumentParser(description="Parallel k-means mapper")
+parser.add_argument('--dataset', metavar='PATH',
+                    help="read the points from a binary dataset")
+parser.add_argument('--range', metavar='START:END',
+                    help="only read this byte range of the dataset")
+parser.add_argument('--coreset', metavar='M', type=int, nargs='?',
+                    const=CORESET,
+                    help="emit a weighted sample of M points (default %d) "
+                         "instead of the local centers" % CORESET)
+parser.add_argument('--seed', type=int, default=SEED,
+                    help="the seed the coreset is drawn with, combined with "
+                         "the first points of the split")
+parser.add_argument('--dtype', choices=sorted(DTYPES), default='float64',
+                    help="compute the distances in this type; float32 "
+                         "also prints the centers with 7 digits")
+args = parser.parse_args()
+
+if args.dataset:
+    # Memory map the points of the binary dataset.
+    import binfmt
+
+    dataset, first, last = binfmt.open_range(args.dataset, args.range)
+    data = np.asarray(dataset.column('points')[first:last],
+                      dtype=DTYPES[args.dtype])
+else:
+    # Read data from standard input.
+    data = np.concatenate(list(textparse.dense(sys.stdin,
+                                               dtype=DTYPES[args.dtype])))
+
+if args.coreset:
+    # Summarize the points by a coreset.
+    rng = round_state(args.seed, args.coreset, None, data[:BLOCK_POINTS])
+    centers, counters = coreset(data, args.coreset, args.dtype, rng)
+else:
+    # Apply Kmeans clustering.
+    centers, counters = kmeans(data, ITERATIONS, args.dtype)
 
 # Emit data for the reducer.
-emit(centers, counters)
+emit(centers, counters, args.dtype)
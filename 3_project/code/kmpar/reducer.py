@@ -1,69 +1,40 @@
+import os
 import sys
 import numpy        as np
-import numpy.linalg as la
-import numpy.random as rng
 
-ITERATIONS = 10
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from assign import Assigner
+from lloyd import lloyd
+from seeding import SEED, kmeanspp
+
+ITERATIONS = 100  # Upper bound, the iterations stop once no point moves.
+RESTARTS = 5      # Seedings tried, the clustering of least cost is kept.
 NUM_C = 100
 NUM_F = 500
 MAX_F = sys.float_info.max
 MIN_F = sys.float_info.min
 
-def euclidean(x, y):
-    return la.norm(x - y, ord=2)
-
-def nearest(point, centers):
-    min_index       = 0
-    min_distance    = MAX_F
-
-    for i in xrange(0, centers.shape[0]):
-        distance = euclidean(centers[i], point)
-
-        if distance < min_distance:
-            min_distance = distance
-            min_index    = i
-
-    return min_index
-
 def kmeans(data, weights, invariant):
-    # Sample centers in the range defined by the data.
-    data_min = data.min(axis=0)
-    data_max = data.max(axis=0)
-    data_rng = data_max - data_min
-
-    C = rng.rand(NUM_C, NUM_F)
-
-    for cIndex in xrange(0, NUM_C):
-        C[cIndex] *= data_rng
-        C[cIndex] += data_min
-
-    C_previous = np.zeros(C.shape)
-    C_change   = C - C_previous
-
-    # Iterate over the center until the invariant is met.
-    for i in xrange(0, invariant):
-        sys.stderr.write("Iteration: %d\n" % (i))
+    # Seed the centers with k-means++ several times and keep the clustering
+    # of least weighted cost, as a single seeding may miss clusters.
+    rng     = np.random.RandomState(SEED)
+    weights = np.asarray(weights, dtype=float)
+    best    = None
+    for restart in xrange(RESTARTS):
+        C = kmeanspp(data, NUM_C, weights, rng=rng)
+
+        # Iterate until no point changes its center, at most invariant times.
+        C, counters, stats = lloyd(data, C, weights, max_iterations=invariant)
+        cost = np.dot(Assigner(C).assign(data)[1], weights)
+        sys.stderr.write("Iterations: %d, distances computed: %d, skipped: %d, "
+                         "cost: %f\n" % (stats['iterations'], stats['computed'],
+                                         stats['skipped'], cost))
         sys.stderr.flush()
 
-        additions = np.zeros(C.shape)
-        counters  = np.zeros(C.shape[0])
-
-        for index in xrange(0, data.shape[0]):
-            point     = data[index]
-            weight    = weights[index]
-            center    = nearest(point, C)
-            direction = point - C[center]
-
-            additions[center] += direction*weight
-            counters[center]  += weight
-
-        for center in xrange(0, C.shape[0]):
-            counter = counters[center]
-            counter = max(counter, 1)
-            addition = additions[center]
-            C[center] += addition/counter
+        if best is None or cost < best[0]:
+            best = (cost, C)
 
-    emit(C)
+    emit(best[1])
 
 def emit(centers):
     for center in centers:
@@ -99,7 +70,7 @@ for line in sys.stdin:
 
     inpt = np.fromstring(vals, sep=' ')
     data.append(inpt)
-    cnts.append(int(cnt))
+    cnts.append(float(cnt))
 
 array = np.array(data)
 kmeans(array, cnts, ITERATIONS)
\ No newline at end of file
@@ -0,0 +1,119 @@
+import numpy as np
+
+from assign import BLOCK_POINTS, Assigner, accumulate
+
+# ACCELERATED LLOYD
+#----------------------------------------------------------
+# Lloyd iterations with Hamerly's bounds. Every point keeps an upper bound
+# on the distance to its center and a lower bound on the distance to any
+# other center. A point keeps its center without computing any distance
+# if its upper bound is below the larger of its lower bound and half the
+# distance from its center to the closest other center. Otherwise the
+# upper bound is tightened first, and only if that does not settle it
+# are the distances to all centers computed. After the centers move, the
+# bounds are loosened by the distances the centers moved.
+
+MAX_ITERATIONS  = 100   # Upper bound on the number of iterations.
+
+def nearest_two(assigner, points):
+    """
+    Computes the nearest and the second nearest center of the points.
+
+    @return: An (indices, distance, second distance) tuple.
+    """
+    indices = np.empty(len(points), dtype=int)
+    first   = np.empty(len(points))
+    second  = np.empty(len(points))
+
+    for start in xrange(0, len(points), BLOCK_POINTS):
+        distances = np.sqrt(assigner.distances(points[start:start + BLOCK_POINTS]))
+        end       = start + len(distances)
+        rows      = np.arange(len(distances))
+
+        indices[start:end] = distances.argmin(axis=1)
+        first[start:end]   = distances[rows, indices[start:end]]
+        distances[rows, indices[start:end]] = np.inf
+        second[start:end]  = distances.min(axis=1)
+
+    return (indices, first, second)
+
+def lloyd(points, centers, weights=None, max_iterations=MAX_ITERATIONS,
+          dtype=np.float64):
+    """
+    Runs Lloyd iterations until no point changes its center, or for at most
+    max_iterations. Centers without points keep their position.
+
+    @param points:         The points.
+    @param centers:        The initial centers.
+    @param weights:        The weights of the points, or None.
+    @param max_iterations: Upper bound on the number of iterations.
+    @param dtype:          The type the distances are computed in.
+
+    @return: A (centers, counts, stats) tuple, where counts holds the weight
+             of the points of every center and stats is a dictionary with
+             the number of iterations and of computed and skipped
+             point-center distances.
+    """
+    points   = np.asarray(points, dtype=dtype)
+    centers  = np.array(centers, dtype=np.float64)
+    count    = len(centers)
+    assigner = Assigner(centers, dtype)
+    stats    = {'iterations': 0, 'computed': 0, 'skipped': 0}
+
+    indices, upper, lower = nearest_two(assigner, points)
+    stats['computed'] += len(points)*count
+
+    for iteration in xrange(max_iterations):
+        # Move the centers to the means of their points.
+        sums, counts = accumulate(points, indices, count, weights)
+        filled       = counts > 0
+        moved        = centers.copy()
+        moved[filled] = sums[filled]/counts[filled, np.newaxis]
+        shifts       = np.sqrt(((moved - centers)**2).sum(axis=1))
+        centers      = moved
+        assigner.update(centers)
+        stats['iterations'] += 1
+
+        if not shifts.any():
+            break
+
+        # Loosen the bounds by the movement of the centers.
+        upper += shifts[indices]
+        order  = np.argsort(shifts)
+        other  = np.where(indices == order[-1], shifts[order[-2]],
+                          shifts[order[-1]]) if count > 1 else 0.0
+        lower -= other
+
+        # Half the distance of every center to its closest other center.
+        separation = np.sqrt(assigner.distances(centers))
+        np.fill_diagonal(separation, np.inf)
+        half = 0.5*separation.min(axis=1)
+
+        bound   = np.maximum(half[indices], lower)
+        check   = np.flatnonzero(upper > bound)
+
+        # Tighten the upper bounds of the points that might move.
+        tight = np.sqrt(((points[check] - centers[indices[check]])**2)
+                        .sum(axis=1))
+        upper[check] = tight
+        stats['computed'] += len(check)
+
+        full = check[tight > bound[check]]
+        if len(full) > 0:
+            new, first, second = nearest_two(assigner, points[full])
+            stats['computed'] += len(full)*count
+            changed = np.count_nonzero(new != indices[full])
+            indices[full] = new
+            upper[full]   = first
+            lower[full]   = second
+        else:
+            changed = 0
+
+        stats['skipped'] += len(points)*count - len(check) - len(full)*count
+
+        # The centers are the means of the unchanged assignment.
+        if changed == 0:
+            break
+
+    counts = np.bincount(indices, weights=weights, minlength=count)
+    return (centers, counts, stats)
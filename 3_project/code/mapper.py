@@ -1,9 +1,13 @@
 #!/local/anaconda/bin/python
 # IMPORTANT: leave the above line as is.
 
+import argparse
+import os
 import sys
 import numpy        as np
-import numpy.linalg as la
+
+from assign import BLOCK_POINTS, DTYPES, Assigner, accumulate, format_point
+from seeding import random_centers
 
 # SEEDS
 #----------------------------------------------------------
@@ -14,34 +18,120 @@ np.random.seed(42) # Should be the right answer.
 #----------------------------------------------------------
 FEATURES        = 500
 CENTER_COUNT    = 100
-CENTER_SCALE    = 2.0
-CENTER_BIAS     = 1.0
-CENTERS         = np.random.rand(CENTER_COUNT, FEATURES) * CENTER_SCALE - CENTER_BIAS;
+BATCH_SIZE      = 1024 # Points per mini-batch in the mini-batch mode.
+DTYPE           = 'float64' # The type the distances are computed in.
+CENTERS         = random_centers(CENTER_COUNT, FEATURES)
+TOOLS           = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                               '..', '..', 'tools')
+
+sys.path.append(TOOLS)
+import textparse
+
+def read_points(dataset=None, byte_range=None, size=BLOCK_POINTS):
+    """
+    Reads blocks of size points from stdin, or from a dataset written by
+    tools/binfmt.py, optionally only those in a byte range of it.
+    """
+    dtype = DTYPES[DTYPE]
+    if dataset is None:
+        for chunk in textparse.dense(sys.stdin, size, dtype):
+            yield chunk
+        return
+
+    import binfmt
+
+    dataset, first, last = binfmt.open_range(dataset, byte_range)
+    points = dataset.column('points')
+    for start in xrange(first, last, size):
+        yield np.asarray(points[start:min(start + size, last)], dtype=dtype)
+
+def assignment(blocks):
+    """
+    Assigns all points to the nearest of the initial centers.
+
+    @return: The means and the counts of the points of every center.
+    """
+    means    = np.zeros(CENTERS.shape)
+    counts   = np.zeros(CENTER_COUNT, dtype=int)
+    assigner = Assigner(CENTERS, DTYPES[DTYPE])
+
+    for data in blocks:
+        indx, _     = assigner.assign(data)
+        sums, cnts  = accumulate(data, indx, CENTER_COUNT)
+
+        means  += sums
+        counts += cnts
 
-def smallest(data):
-    connections = np.subtract(CENTERS, data)
-    norms       = la.norm(connections, 2, 1)
-    return np.argmin(norms)
+    means /= np.maximum(counts, 1)[:, np.newaxis]
+    return (means, counts)
 
-means  = np.zeros(CENTERS.shape)
-counts = np.zeros(CENTER_COUNT, dtype=int)
+def minibatch(batches):
+    """
+    Runs mini-batch k-means in a single pass over the batches, starting
+    from the initial centers. Every center moves towards the points of a
+    batch assigned to it with the learning rate 1/n, where n counts all
+    points assigned to it so far, so a center is the mean of its points.
 
-for line in sys.stdin:
-    line = line.strip()
-    data = np.fromstring(line, sep=' ')
-    indx = smallest(data)
+    @return: The centers and the counts of the points of every center.
+    """
+    centers  = CENTERS.copy()
+    counts   = np.zeros(CENTER_COUNT, dtype=int)
+    assigner = Assigner(centers, DTYPES[DTYPE])
 
-    means[indx]  += data
-    counts[indx] += 1
+    for data in batches:
+        indx, _     = assigner.assign(data)
+        sums, cnts  = accumulate(data, indx, CENTER_COUNT)
+
+        counts += cnts
+        moved   = np.flatnonzero(cnts)
+        rates   = 1.0/counts[moved]
+        centers[moved] += rates[:, np.newaxis]*(sums[moved] -
+                          cnts[moved, np.newaxis]*centers[moved])
+
+        assigner.update(centers)
+
+    return (centers, counts)
+
+parser = argparse.ArgumentParser(description="K-means mapper")
+parser.add_argument('--dataset', metavar='PATH',
+                    help="read the points from a binary dataset")
+parser.add_argument('--range', metavar='START:END',
+                    help="only read this byte range of the dataset")
+parser.add_argument('--minibatch', action='store_true',
+                    help="run mini-batch k-means with bounded memory")
+parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                    help="the number of points per mini-batch")
+parser.add_argument('--centers', metavar='FILE',
+                    help="start from these centers, e.g. seeded by "
+                         "seeding.py, instead of random ones")
+parser.add_argument('--dtype', choices=sorted(DTYPES), default=DTYPE,
+                    help="compute the distances in this type; float32 "
+                         "also prints the means with 7 digits")
+args = parser.parse_args()
+
+DTYPE = args.dtype
+
+if args.centers:
+    with open(args.centers, "r") as inf:
+        CENTERS      = np.concatenate(list(textparse.dense(inf)))
+    CENTER_COUNT = len(CENTERS)
+
+if args.minibatch:
+    batches       = read_points(args.dataset, args.range, args.batch_size)
+    means, counts = minibatch(batches)
+else:
+    means, counts = assignment(read_points(args.dataset, args.range))
 
 for indx in xrange(CENTER_COUNT):
     cnt  = counts[indx]
 
+    # A center without points is not emitted, the reducer keeps it where
+    # it started.
     if cnt == 0:
-        cnt = 1
-        
-    mean = means[indx]/cnt
-    mstr = ' '.join([str(f) for f in mean])
+        continue
+
+    mean = means[indx]
+    mstr = format_point(mean, DTYPE)
 
     print("(%d, %d|%s)" % (indx, cnt, mstr))
     
@@ -1,9 +1,14 @@
 #!/local/anaconda/bin/python
 # IMPORTANT: leave the above line as is.
 
+import argparse
+import os
 import sys
 import numpy as np
 
+from assign import DTYPES, format_point
+from seeding import random_centers
+
 # SEEDS
 #----------------------------------------------------------
 np.random.seed(42) # Should be the right answer.
@@ -13,9 +18,12 @@ np.random.seed(42) # Should be the right answer.
 #----------------------------------------------------------
 FEATURES        = 500
 CENTER_COUNT    = 100
-CENTER_SCALE    = 1.0
-CENTER_BIAS     = 0.5
-CENTERS         = np.random.rand(CENTER_COUNT, FEATURES) * CENTER_SCALE - CENTER_BIAS;
+CENTERS         = random_centers(CENTER_COUNT, FEATURES)
+TOOLS           = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                               '..', '..', 'tools')
+
+sys.path.append(TOOLS)
+import textparse
 
 
 # PROCESSING
@@ -26,7 +34,7 @@ def process(key, cnts, data):
     data_cunts = float(np.sum(cnts))
 
     if data_count > 0:
-        data_sum = np.zeros(500)
+        data_sum = np.zeros(CENTERS.shape[1])
 
         for line in xrange(0, data_count):
             mean_fact = cnts[line]/data_cunts
@@ -43,6 +51,18 @@ def reset(target):
 # DATA HANDLING
 #-------------------------------------------------------
 
+parser = argparse.ArgumentParser(description="K-means reducer")
+parser.add_argument('--centers', metavar='FILE',
+                    help="the centers the mappers started from, kept for "
+                         "the centers without points")
+parser.add_argument('--dtype', choices=sorted(DTYPES), default='float64',
+                    help="float32 prints the centers with 7 digits")
+args = parser.parse_args()
+
+if args.centers:
+    with open(args.centers, "r") as inf:
+        CENTERS = np.concatenate(list(textparse.dense(inf)))
+
 curr_key = None
 last_key = None
 data     = []
@@ -67,10 +87,11 @@ for line in sys.stdin:
     data.append(inpt)
     cnts.append(int(cnt))
 
-process(curr_key, cnts, data)
+if curr_key is not None:
+    process(curr_key, cnts, data)
 
 for center in CENTERS:
-    print(' '.join([str(f) for f in center]))
+    print(format_point(center, args.dtype))
 
 
     
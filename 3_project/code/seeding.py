@@ -0,0 +1,304 @@
+#!/local/anaconda/bin/python
+# IMPORTANT: leave the above line as is.
+
+import argparse
+import itertools
+import os
+import sys
+import zlib
+import numpy        as np
+
+from assign import BLOCK_POINTS, Assigner, accumulate
+
+# K-MEANS|| SEEDING
+#----------------------------------------------------------
+# Chooses initial centers with k-means|| (Bahmani et al.) as a sequence
+# of MapReduce jobs over the points, all run with --centers CANDIDATES
+# on both the mapper and the reducer:
+#
+#  1. Without candidates, every mapper emits one uniformly drawn point,
+#     which the reducer turns into the first candidates.
+#  2. Every round, each mapper emits the cost of its points with respect to
+#     the candidates, how many of its points are nearest to each candidate,
+#     and samples every point x with probability min(1, l*d(x)^2/cost),
+#     where cost is the total cost of the previous round and l is the
+#     oversampling factor. The reducer writes the new cost and the
+#     candidates with their weights, followed by the samples.
+#  3. A final round with --factor 0 weighs all candidates, and the reducer
+#     run with --k reduces them to k centers with a weighted k-means++
+#     followed by a few weighted Lloyd iterations.
+#
+# A candidates file holds the cost of the round on its first line and
+# "weight coordinates" on every further line. Its first round has no cost
+# yet, so it samples nothing and only measures the cost.
+#
+# Every round must draw afresh: a point that was not sampled in a round only
+# gets closer to the candidates, so replaying the same uniform draws against
+# the same cost would never sample it again. The random state of a mapper
+# is therefore derived from --seed, the candidates count, the cost and the
+# first points of its split, which differ between rounds and splits, and
+# all rounds can be run with the same --seed.
+
+FACTOR          = 200   # The oversampling factor l, about 2k.
+ROUNDS          = 5     # The number of sampling rounds.
+REFINEMENTS     = 10    # Weighted Lloyd iterations after k-means++.
+SEED            = 42
+CENTER_SCALE    = 2.0   # Random centers are uniform in [-1, 1).
+CENTER_BIAS     = 1.0
+
+TOOLS           = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                               '..', '..', 'tools')
+
+sys.path.append(TOOLS)
+import textparse
+
+# K-MEANS++
+#----------------------------------------------------------
+
+def random_centers(count, features, seed=SEED):
+    """
+    Draws the random initial centers, which the mapper and the reducer of
+    a Lloyd step use when they are not given any centers.
+    """
+    rng = np.random.RandomState(seed)
+    return rng.rand(count, features)*CENTER_SCALE - CENTER_BIAS
+
+def kmeanspp(points, k, weights=None, rng=np.random):
+    """
+    Chooses k of the points as centers with k-means++: every center is
+    drawn with probability proportional to its weight times its squared
+    distance to the closest center drawn so far.
+
+    @param points:  The points to choose from.
+    @param k:       The number of centers.
+    @param weights: The weights of the points, or None for unit weights.
+    @param rng:     The random number generator to draw with.
+
+    @return: The centers.
+    """
+    points  = np.atleast_2d(points)
+    weights = np.ones(len(points)) if weights is None else \
+              np.asarray(weights, dtype=float)
+
+    if len(points) <= k:
+        return points.copy()
+
+    chosen  = [rng.choice(len(points), p=weights/weights.sum())]
+    closest = Assigner(points[chosen]).distances(points)[:, 0]
+
+    for _ in xrange(1, k):
+        scores = weights*closest
+        total  = scores.sum()
+        if total > 0:
+            index = np.searchsorted(np.cumsum(scores), rng.rand()*total,
+                                    side='right')
+            index = min(index, len(points) - 1)
+        else:
+            # All points coincide with a center, take any other one.
+            index = np.flatnonzero(~np.in1d(np.arange(len(points)),
+                                            chosen))[0]
+
+        chosen.append(index)
+        distances = Assigner(points[index:index + 1]).distances(points)[:, 0]
+        np.minimum(closest, distances, out=closest)
+
+    return points[chosen].copy()
+
+def refine(centers, points, weights, iterations=REFINEMENTS):
+    """
+    Runs weighted Lloyd iterations on the points. Centers without weight
+    keep their position.
+    """
+    centers  = centers.copy()
+    assigner = Assigner(centers)
+    for _ in xrange(iterations):
+        indx, _      = assigner.assign(points)
+        sums, counts = accumulate(points, indx, len(centers), weights)
+        filled       = counts > 0
+        centers[filled] = sums[filled]/counts[filled, np.newaxis]
+        assigner.update(centers)
+
+    return centers
+
+# FILES
+#----------------------------------------------------------
+
+def read_points(dataset=None, byte_range=None):
+    """
+    Reads blocks of points from stdin, or from a dataset written by
+    tools/binfmt.py, optionally only those in a byte range of it.
+    """
+    if dataset is None:
+        for chunk in textparse.dense(sys.stdin, BLOCK_POINTS):
+            yield chunk
+        return
+
+    import binfmt
+
+    dataset, first, last = binfmt.open_range(dataset, byte_range)
+    points = dataset.column('points')
+    for start in xrange(first, last, BLOCK_POINTS):
+        yield points[start:min(start + BLOCK_POINTS, last)]
+
+def read_candidates(path):
+    """
+    Reads a candidates file.
+
+    @return: A (cost, weights, candidates) tuple, where cost is None before
+             it has been measured.
+    """
+    with open(path, "r") as inf:
+        cost = float(inf.readline())
+        rows = np.concatenate(list(textparse.dense(inf)))
+
+    cost = None if np.isinf(cost) else cost
+    return (cost, rows[:, 0], rows[:, 1:])
+
+def write_candidates(cost, weights, candidates):
+    print("%r" % cost)
+    for weight, candidate in zip(weights, candidates):
+        print("%d %s" % (weight, ' '.join([str(f) for f in candidate])))
+
+def emit_point(point):
+    print("(sample, %s)" % ' '.join([str(f) for f in point]))
+
+# MAPPER
+#----------------------------------------------------------
+
+def round_state(seed, count, cost, block=None):
+    """
+    Derives the random state of a round, and of a split if its first block
+    of points is given.
+
+    @param seed:  The seed of all rounds.
+    @param count: The number of candidates.
+    @param cost:  The cost of the previous round, or None.
+    @param block: The first block of points of the split, or None.
+    """
+    digest = zlib.crc32('%d %d %r' % (seed, count, cost))
+    if block is not None:
+        digest = zlib.crc32(np.ascontiguousarray(block).tostring(), digest)
+
+    return np.random.RandomState(digest & 0xffffffff)
+
+def sample_first(blocks, rng):
+    """
+    Draws one point uniformly with reservoir sampling.
+    """
+    sample = None
+    seen   = 0
+    for block in blocks:
+        for point in block:
+            seen += 1
+            if rng.randint(seen) == 0:
+                sample = np.array(point)
+
+    if sample is not None:
+        emit_point(sample)
+
+def oversample(blocks, candidates, cost, factor, rng):
+    """
+    Measures the cost and the weights of the candidates on the points and
+    samples new candidates.
+    """
+    assigner = Assigner(candidates)
+    total    = 0.0
+    weights  = np.zeros(len(candidates), dtype=int)
+
+    for block in blocks:
+        indx, distances = assigner.assign(block)
+        weights        += np.bincount(indx, minlength=len(candidates))
+        total          += distances.sum()
+
+        if cost is not None and factor > 0:
+            probability = np.minimum(1.0, factor*distances/cost)
+            for index in np.flatnonzero(rng.rand(len(block)) < probability):
+                emit_point(block[index])
+
+    print("(cost, %r)" % total)
+    for index in np.flatnonzero(weights):
+        print("(center, %d|%d)" % (index, weights[index]))
+
+# REDUCER
+#----------------------------------------------------------
+
+def collect(stream, count):
+    """
+    Collects the records of the mappers.
+
+    @return: A (cost, weights, samples) tuple.
+    """
+    cost    = 0.0
+    weights = np.zeros(count, dtype=int)
+    samples = []
+
+    for line in stream:
+        line      = line.strip()
+        if not line:
+            continue
+        line      = line.lstrip('(')
+        line      = line.rstrip(')')
+        key, vals = line.split(', ')
+
+        if key == 'cost':
+            cost += float(vals)
+        elif key == 'center':
+            index, weight = vals.split('|')
+            weights[int(index)] += int(weight)
+        else:
+            samples.append(np.fromstring(vals, sep=' '))
+
+    return (cost, weights, samples)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="K-means|| seeding; see "
+                                     "the comment at the top of the file")
+    parser.add_argument('mode', choices=['map', 'reduce'])
+    parser.add_argument('--centers', metavar='CANDIDATES',
+                        help="the candidates of the previous round")
+    parser.add_argument('--factor', type=float, default=FACTOR,
+                        help="the oversampling factor")
+    parser.add_argument('--k', type=int,
+                        help="reduce: reduce the candidates to k centers")
+    parser.add_argument('--seed', type=int, default=SEED)
+    parser.add_argument('--dataset', metavar='PATH',
+                        help="map: read the points from a binary dataset")
+    parser.add_argument('--range', metavar='START:END',
+                        help="map: only read this byte range of the dataset")
+    args = parser.parse_args()
+
+    if args.centers:
+        cost, weights, candidates = read_candidates(args.centers)
+    else:
+        cost, weights, candidates = (None, np.zeros(0), None)
+
+    if args.mode == 'map':
+        blocks = read_points(args.dataset, args.range)
+        first  = next(blocks, None)
+        rng    = round_state(args.seed, len(weights), cost, first)
+        if first is not None:
+            blocks = itertools.chain([first], blocks)
+
+        if candidates is None:
+            sample_first(blocks, rng)
+        else:
+            oversample(blocks, candidates, cost, args.factor, rng)
+        sys.exit(0)
+
+    rng = round_state(args.seed, len(weights), cost)
+    total, weights, samples = collect(sys.stdin, len(weights))
+
+    if args.k is not None:
+        centers = kmeanspp(candidates, args.k, weights, rng)
+        centers = refine(centers, candidates, weights)
+        for center in centers:
+            print(' '.join([str(f) for f in center]))
+        sys.exit(0)
+
+    if candidates is None:
+        # The first round only drew points, the cost is measured next.
+        write_candidates(float('inf'), np.zeros(len(samples)), samples)
+    else:
+        samples = np.array(samples).reshape(-1, candidates.shape[1])
+        write_candidates(total, np.r_[weights, np.zeros(len(samples))],
+                         np.concatenate([candidates, samples]))
@@ -1,6 +1,47 @@
+import os
 import sys
 import policy
 
+TOOLS = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..',
+                     'tools')
+sys.path.append(TOOLS)
+import textparse
+
+def read_log(path):
+    """
+    Reads the log lines from a text file, or from a dataset written by
+    tools/binfmt.py.
+
+    @return: A generator of (time, user features, chosen article, reward,
+             available articles) tuples.
+    """
+    if not os.path.isdir(path):
+        with file(path) as inf:
+            for (times, users, chosen, rewards, values, offsets) in \
+                    textparse.bandit(inf):
+                times = times.tolist()
+                users = users.tolist()
+                chosen = chosen.tolist()
+                rewards = rewards.tolist()
+                values = values.tolist()
+                offsets = offsets.tolist()
+                for i in xrange(len(times)):
+                    yield (times[i], users[i], chosen[i], rewards[i],
+                           values[offsets[i]:offsets[i + 1]])
+        return
+
+    import binfmt
+
+    dataset = binfmt.Dataset(path)
+    users = dataset.column('users')
+    times = dataset.column('times')
+    chosen = dataset.column('chosen')
+    rewards = dataset.column('rewards')
+    values, offsets = dataset.column('articles')
+    for i in xrange(len(dataset)):
+        yield (int(times[i]), users[i].tolist(), int(chosen[i]),
+               int(rewards[i]), values[offsets[i]:offsets[i + 1]].tolist())
+
 if __name__ == "__main__":
 
     if (len(sys.argv) != 3):
@@ -19,24 +60,17 @@ if __name__ == "__main__":
     total_evaluated = 0
     n_lines = 0
 
-    with file(sys.argv[2]) as inf:
-        for line in inf:
-            n_lines += 1
-            logline = line.strip().split()
-            chosen = int(logline.pop(7))
-            reward = int(logline.pop(7))
-            time = int(logline[0])
-            user_features = [float(x) for x in logline[1:7]]
-            articles = [int(x) for x in logline[7:]]
-
-            calculated = policy.reccomend(time, user_features, articles)
-
-            if calculated == chosen:
-                policy.update(reward)
-                score += reward
-                total_evaluated += 1
-            else:
-                policy.update(-1)
-
-        print "Evaluated %d/%d lines." % (total_evaluated, n_lines)
-        print "CTR=%f" % (float(score) / total_evaluated)
+    for (time, user_features, chosen, reward, articles) in read_log(sys.argv[2]):
+        n_lines += 1
+
+        calculated = policy.recommend(time, user_features, articles)
+
+        if calculated == chosen:
+            policy.update(reward)
+            score += reward
+            total_evaluated += 1
+        else:
+            policy.update(-1)
+
+    print "Evaluated %d/%d lines." % (total_evaluated, n_lines)
+    print "CTR=%f" % (float(score) / total_evaluated)
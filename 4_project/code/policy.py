@@ -10,12 +10,18 @@ def set_articles(articles):
     pass
 
 def update(reward):
-    articles_dic[maxID][0] += user_feat * user_feat.T
+    # A reward of -1 means the log chose another article, nothing is learnt.
+    if reward == -1:
+        return
+
+    articles_dic[maxID][0] += numpy.outer(user_feat, user_feat)
     articles_dic[maxID][1] += reward*user_feat
 
 def recommend(time, user_features, articles):
+    global user_feat, maxID
 
     maxUCB = None
+    user_features = numpy.asarray(user_features, dtype=float)
     user_feat = user_features
     for id in articles:
 
@@ -24,11 +30,11 @@ def recommend(time, user_features, articles):
 
         # initialize weights
         M_x_inv = numpy.linalg.inv(M_x)
-        w_t = M_x_inv * b_x
+        w_t = M_x_inv.dot(b_x)
 
         #set UCBx
 
-        UCBx = numpy.dot(w_t,user_features) + alpha*numpy.sqrt(numpy.transpose(user_features)*M_x_inv*user_features)
+        UCBx = numpy.dot(w_t,user_features) + alpha*numpy.sqrt(user_features.dot(M_x_inv).dot(user_features))
 
         if maxUCB is None or UCBx > maxUCB:
             maxUCB = UCBx
@@ -40,5 +46,5 @@ def addToDic(id):
     if id in articles_dic:
         return articles_dic[id]
     else:
-        articles_dic[id] = (numpy.identity(6),numpy.zeros(6))
+        articles_dic[id] = [numpy.identity(6),numpy.zeros(6)]
         return articles_dic[id]
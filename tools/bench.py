@@ -0,0 +1,240 @@
+#!/usr/bin/env python
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import synth
+
+#--------------------------------------------------------------------------
+# CONSTANTS
+
+ROOT      = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+LSH       = os.path.join(ROOT, '1_project', 'src')
+SVM       = os.path.join(ROOT, '2_project', 'src')
+KMEANS    = os.path.join(ROOT, '3_project', 'code')
+KMPAR     = os.path.join(ROOT, '3_project', 'code', 'kmpar')
+BANDIT    = os.path.join(ROOT, '4_project', 'code')
+
+SCALES    = [1000, 5000]
+TOLERANCE = 0.2             # Relative slowdown reported as regression.
+
+#--------------------------------------------------------------------------
+# PIPELINES
+#
+# A pipeline is a list of steps (stage, command, stdin, stdout, cwd). The
+# command is run with the interpreter of the benchmark, stdin and stdout
+# are files in the working directory of the run. The special stage
+# 'shuffle' sorts its input lines instead of running a command.
+
+def step(stage, script, args=(), stdin=None, stdout=None, cwd=None):
+    return (stage, [script] + list(args), stdin, stdout, cwd)
+
+def lsh(data, work):
+    dups = data + '.duplicates'
+    return [step('map',         os.path.join(LSH, 'mapper.py'),  [], data, 'map.txt'),
+            step('map-compact', os.path.join(LSH, 'mapper.py'),  ['--format', 'compact'],
+                 data, 'compact.txt'),
+            ('shuffle', None, 'compact.txt', 'sorted.txt', None),
+            step('reduce',      os.path.join(LSH, 'reducer.py'), [], 'sorted.txt', 'pairs.txt'),
+            step('evaluate',    os.path.join(LSH, 'check.py'),
+                 [os.path.join(work, 'pairs.txt'), dups], None, 'check.txt')]
+
+def svm(data, work):
+    return [step('map',         os.path.join(SVM, 'mapper.py'),  [], data, 'map.txt'),
+            ('shuffle', None, 'map.txt', 'sorted.txt', None),
+            step('reduce',      os.path.join(SVM, 'reducer.py'), [], 'sorted.txt', 'weights.txt'),
+            step('evaluate',    os.path.join(SVM, 'evaluate.py'),
+                 [os.path.join(work, 'weights.txt'), data + '.data', data + '.labels', SVM],
+                 None, 'accuracy.txt')]
+
+def kmeans(data, work):
+    return [step('map',         os.path.join(KMEANS, 'mapper.py'),  [], data, 'map.txt'),
+            ('shuffle', None, 'map.txt', 'sorted.txt', None),
+            step('reduce',      os.path.join(KMEANS, 'reducer.py'), [], 'sorted.txt', 'centers.txt'),
+            step('evaluate',    os.path.join(KMEANS, 'evaluate.py'),
+                 [os.path.join(work, 'centers.txt'), data], None, 'error.txt')]
+
+def kmpar(data, work):
+    return [step('map',         os.path.join(KMPAR, 'mapper.py'),  [], data, 'map.txt'),
+            ('shuffle', None, 'map.txt', 'sorted.txt', None),
+            step('reduce',      os.path.join(KMPAR, 'reducer.py'), [], 'sorted.txt', 'centers.txt'),
+            step('evaluate',    os.path.join(KMEANS, 'evaluate.py'),
+                 [os.path.join(work, 'centers.txt'), data], None, 'error.txt')]
+
+def bandit(data, work):
+    return [step('evaluate',    os.path.join(BANDIT, 'evaluator.py'),
+                 [data + '.articles', data], None, 'ctr.txt', BANDIT)]
+
+PIPELINES = {'lsh':    (synth.videos, lsh),
+             'svm':    (synth.svm,    svm),
+             'kmeans': (synth.kmeans, kmeans),
+             'kmpar':  (synth.kmeans, kmpar),
+             'bandit': (synth.bandit, bandit)}
+
+#--------------------------------------------------------------------------
+# RUNNING
+
+def revision():
+    """
+    Returns the current git revision, or None outside of a repository.
+    """
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                       cwd=ROOT).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def size(path):
+    return os.path.getsize(path) if path and os.path.exists(path) else 0
+
+def run_step(stage, command, stdin, stdout, cwd, work, interpreter):
+    """
+    Runs and times a single step of a pipeline.
+
+    @return: A tuple of the status, the seconds and the bytes read and
+             written.
+    """
+    stdin  = stdin  and os.path.join(work, stdin)
+    stdout = stdout and os.path.join(work, stdout)
+    start  = time.time()
+
+    if stage == 'shuffle':
+        with open(stdin, 'rb') as inf:
+            lines = inf.readlines()
+        lines.sort()
+        with open(stdout, 'wb') as outf:
+            outf.writelines(lines)
+        status = 0
+    else:
+        with open(os.devnull, 'rb') if stdin is None else open(stdin, 'rb') as inf:
+            with open(stdout, 'wb') as outf:
+                with open(stdout + '.err', 'wb') as errf:
+                    status = subprocess.call([interpreter] + command, stdin=inf,
+                                             stdout=outf, stderr=errf,
+                                             cwd=cwd or work)
+
+    return (status, time.time() - start, size(stdin), size(stdout))
+
+def bench(pipeline, scale, datadir, interpreter, seed, keep=False):
+    """
+    Generates the data of a pipeline at the specified scale, if it does
+    not exist yet, and times all steps of the pipeline. The outputs of the
+    steps are removed afterwards, unless they are to be kept.
+
+    @return: A list of result records.
+    """
+    generate, steps = PIPELINES[pipeline]
+    data = os.path.join(datadir, '%s-%d-%d.txt' % (generate.__name__, scale, seed))
+    if not os.path.exists(data):
+        generate(data, scale, seed=seed)
+
+    work    = tempfile.mkdtemp(prefix='bench-%s-' % pipeline)
+    results = []
+    failed  = False
+
+    for stage, command, stdin, stdout, cwd in steps(data, work):
+        if failed:
+            status, seconds, read, written = (None, None, 0, 0)
+        else:
+            status, seconds, read, written = run_step(
+                stage, command, stdin, stdout, cwd, work, interpreter)
+            failed = status != 0
+
+        results.append({'pipeline': pipeline,
+                        'stage':    stage,
+                        'scale':    scale,
+                        'status':   'ok' if status == 0 else
+                                    'skipped' if status is None else 'failed',
+                        'seconds':  seconds,
+                        'input':    read,
+                        'output':   written})
+
+    if keep:
+        sys.stderr.write("Kept the outputs of %s in %s\n" % (pipeline, work))
+    else:
+        shutil.rmtree(work, ignore_errors=True)
+
+    return results
+
+def regressions(results, baseline, tolerance):
+    """
+    Compares results with the latest matching records of a baseline file.
+
+    @return: A list of (record, baseline seconds) tuples of all steps that
+             got slower by more than the tolerance.
+    """
+    previous = {}
+    with open(baseline, 'r') as inf:
+        for line in inf:
+            record = json.loads(line)
+            if record['status'] == 'ok':
+                previous[(record['pipeline'], record['stage'], record['scale'])] = record
+
+    slower = []
+    for record in results:
+        key = (record['pipeline'], record['stage'], record['scale'])
+        if record['status'] == 'ok' and key in previous:
+            before = previous[key]['seconds']
+            if record['seconds'] > before*(1.0 + tolerance):
+                slower.append((record, before))
+
+    return slower
+
+#--------------------------------------------------------------------------
+# MAIN
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks the mappers, "
+                                     "reducers and evaluators of all projects "
+                                     "on synthetic data.")
+    parser.add_argument('pipelines', nargs='*', default=sorted(PIPELINES),
+                        help="the pipelines to run (default: all)")
+    parser.add_argument('--scales', type=int, nargs='+', default=SCALES)
+    parser.add_argument('--output', default='bench.jsonl',
+                        help="the file to append the results to")
+    parser.add_argument('--baseline',
+                        help="a previous result file to compare against")
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE)
+    parser.add_argument('--data', default=os.path.join(tempfile.gettempdir(),
+                                                       'bench-data'))
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--interpreter', default=sys.executable)
+    parser.add_argument('--keep', action='store_true',
+                        help="keep the outputs of all steps")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.data):
+        os.makedirs(args.data)
+
+    commit  = revision()
+    stamp   = time.strftime('%Y-%m-%dT%H:%M:%S')
+    results = []
+
+    for pipeline in args.pipelines:
+        for scale in args.scales:
+            for record in bench(pipeline, scale, args.data, args.interpreter,
+                                args.seed, args.keep):
+                record.update({'commit': commit, 'date': stamp})
+                results.append(record)
+                print "%-8s %-12s %8d  %-8s %s" % (
+                    pipeline, record['stage'], scale, record['status'],
+                    '%.3fs' % record['seconds'] if record['seconds'] else '')
+
+    with open(args.output, 'a') as outf:
+        for record in results:
+            outf.write(json.dumps(record, sort_keys=True) + '\n')
+
+    if args.baseline:
+        slower = regressions(results, args.baseline, args.tolerance)
+        for record, before in slower:
+            print "REGRESSION %s %s %d: %.3fs -> %.3fs" % (
+                record['pipeline'], record['stage'], record['scale'],
+                before, record['seconds'])
+        if slower:
+            sys.exit(1)
@@ -0,0 +1,272 @@
+#!/usr/bin/env python
+
+import argparse
+import json
+import numpy as np
+import os
+
+import textparse
+
+#--------------------------------------------------------------------------
+# CONSTANTS
+#
+# A dataset is a directory holding a HEADER file and one .npy file per
+# column, read with np.load(mmap_mode='r') so that no data is copied until
+# it is used. Dense columns hold one row (a scalar or a vector) per sample.
+# Ragged columns hold the values of all samples concatenated, and a
+# <name>.offsets.npy file with the index of the first value of each sample
+# and the total number of values at the end.
+#
+# The first column is the primary column, whose bytes define the byte
+# ranges by which a dataset is split between mappers: a sample belongs to
+# the range that holds the first byte of its primary data.
+
+HEADER     = 'header.json'
+VERSION    = 1
+
+#--------------------------------------------------------------------------
+# DATASETS
+
+def is_dataset(path):
+    """
+    Returns True if the path is a binary dataset.
+    """
+    return os.path.isfile(os.path.join(path, HEADER))
+
+def write(path, kind, columns):
+    """
+    Writes a dataset.
+
+    @param path:    The directory to write the dataset to.
+    @param kind:    The kind of data, one of the keys of PARSERS.
+    @param columns: A list of (name, column) tuples, where a column is an
+                    array, or a (values, offsets) tuple for ragged columns.
+                    The first column is the primary column.
+    """
+    if not os.path.isdir(path):
+        os.makedirs(path)
+
+    header = {'version': VERSION, 'kind': kind, 'rows': None, 'columns': []}
+    for name, column in columns:
+        ragged = isinstance(column, tuple)
+        if ragged:
+            values, offsets = column
+            np.save(os.path.join(path, name + '.npy'), values)
+            np.save(os.path.join(path, name + '.offsets.npy'),
+                    np.asarray(offsets, dtype=np.int64))
+            rows = len(offsets) - 1
+        else:
+            np.save(os.path.join(path, name + '.npy'), column)
+            rows = len(column)
+
+        if header['rows'] is not None and header['rows'] != rows:
+            raise ValueError("Column %s has %d rows instead of %d"
+                             % (name, rows, header['rows']))
+        header['rows'] = rows
+        header['columns'].append({'name': name, 'ragged': ragged})
+
+    # The header is written last, so that a partial dataset is not valid.
+    with open(os.path.join(path, HEADER), 'w') as outf:
+        json.dump(header, outf, indent=1)
+
+class Dataset(object):
+    """
+    A memory mapped binary dataset.
+    """
+    def __init__(self, path):
+        with open(os.path.join(path, HEADER), 'r') as inf:
+            header = json.load(inf)
+
+        if header['version'] != VERSION:
+            raise ValueError("Unsupported dataset version: %d"
+                             % header['version'])
+
+        self.path    = path
+        self.kind    = header['kind']
+        self.rows    = header['rows']
+        self.ragged  = dict((c['name'], c['ragged'])
+                            for c in header['columns'])
+        self.primary = header['columns'][0]['name']
+
+    def __len__(self):
+        return self.rows
+
+    def _load(self, name):
+        return np.load(os.path.join(self.path, name + '.npy'), mmap_mode='r')
+
+    def column(self, name):
+        """
+        Returns a dense column, or the (values, offsets) of a ragged column.
+        """
+        if name not in self.ragged:
+            raise KeyError("No column %s in %s" % (name, self.path))
+        if self.ragged[name]:
+            return (self._load(name), self._load(name + '.offsets'))
+        return self._load(name)
+
+    def size(self):
+        """
+        Returns the size of the primary column in bytes.
+        """
+        if self.ragged[self.primary]:
+            values, _ = self.column(self.primary)
+        else:
+            values = self.column(self.primary)
+        return values.nbytes
+
+    def byte_range(self, start, end):
+        """
+        Returns the rows whose primary data starts in the byte range.
+
+        @return: A (first, last) tuple of the rows in [first, last).
+        """
+        if self.ragged[self.primary]:
+            values, offsets = self.column(self.primary)
+            starts = offsets[:-1]*values.itemsize
+        else:
+            values = self.column(self.primary)
+            rowsize = values.nbytes // max(self.rows, 1)
+            starts = np.arange(self.rows, dtype=np.int64)*rowsize
+
+        return (int(np.searchsorted(starts, start)),
+                int(np.searchsorted(starts, end)))
+
+def parse_range(string):
+    """
+    Parses a 'START:END' byte range, where either end may be omitted.
+
+    @return: A (start, end) tuple, where end is None for the end of data.
+    """
+    start, end = string.split(':')
+    return (int(start or 0), int(end) if end else None)
+
+def open_range(path, byte_range=None):
+    """
+    Opens a dataset and selects the rows of a byte range.
+
+    @param path:       The dataset.
+    @param byte_range: A 'START:END' string, or None for all rows.
+
+    @return: A (dataset, first, last) tuple.
+    """
+    dataset = Dataset(path)
+    if byte_range is None:
+        return (dataset, 0, len(dataset))
+
+    start, end = parse_range(byte_range)
+    if end is None:
+        end = dataset.size()
+    first, last = dataset.byte_range(start, end)
+    return (dataset, first, last)
+
+def ragged_rows(values, offsets, first, last):
+    """
+    Returns the values of the rows in [first, last) of a ragged column.
+    """
+    return [values[offsets[i]:offsets[i + 1]] for i in xrange(first, last)]
+
+#--------------------------------------------------------------------------
+# PARSERS
+#
+# Each parser reads the text format of a project and returns the columns
+# of its dataset.
+
+def concatenate(chunks):
+    """
+    Concatenates the ragged chunks of a column.
+    """
+    values  = []
+    offsets = [np.zeros(1, dtype=np.int64)]
+    total   = 0
+    for (chunk, chunk_offsets) in chunks:
+        values.append(chunk)
+        offsets.append(chunk_offsets[1:] + total)
+        total += chunk_offsets[-1]
+
+    return (np.concatenate(values), np.concatenate(offsets))
+
+def dense(path):
+    """
+    Parses a file of whitespace separated rows of equal length.
+    """
+    with open(path, 'r') as inf:
+        return np.concatenate(list(textparse.dense(inf)))
+
+def parse_videos(path, labels=None):
+    """
+    LSH: 'VIDEO_<id> <shingles>' lines.
+    """
+    with open(path, 'r') as inf:
+        chunks = list(textparse.videos(inf))
+
+    return [('shingles', concatenate((s, o) for (_, s, o) in chunks)),
+            ('vids',     np.concatenate([v for (v, _, _) in chunks]))]
+
+def parse_svm(path, labels=None):
+    """
+    SVM: '<label> <features>' lines, or feature lines with the labels in a
+    separate file of one label per line.
+    """
+    data = dense(path)
+    if labels is None:
+        return [('features', data[:, 1:]),
+                ('labels',   data[:, 0].astype(np.int8))]
+
+    return [('features', data),
+            ('labels',   dense(labels).ravel().astype(np.int8))]
+
+def parse_kmeans(path, labels=None):
+    """
+    K-means: '<features>' lines.
+    """
+    return [('points', dense(path))]
+
+def parse_bandit(path, labels=None):
+    """
+    Bandit log: '<time> <6 user features> <chosen> <reward> <articles>'
+    lines, with a varying number of articles.
+    """
+    with open(path, 'r') as inf:
+        chunks = list(textparse.bandit(inf))
+
+    return [('users',    np.concatenate([c[1] for c in chunks])),
+            ('times',    np.concatenate([c[0] for c in chunks])),
+            ('chosen',   np.concatenate([c[2] for c in chunks])),
+            ('rewards',  np.concatenate([c[3] for c in chunks])
+                         .astype(np.int8)),
+            ('articles', concatenate((c[4], c[5]) for c in chunks))]
+
+PARSERS = {'lsh': parse_videos, 'svm': parse_svm, 'kmeans': parse_kmeans,
+           'bandit': parse_bandit}
+
+def convert(kind, source, target, labels=None, dtype=None):
+    """
+    Converts a text file of the specified kind into a dataset. If a dtype
+    is given, the dense floating point columns are stored in it.
+    """
+    columns = PARSERS[kind](source, labels)
+    if dtype is not None:
+        columns = [(name, column.astype(dtype))
+                   if not isinstance(column, tuple) and
+                      np.issubdtype(column.dtype, np.floating)
+                   else (name, column) for (name, column) in columns]
+
+    write(target, kind, columns)
+
+#--------------------------------------------------------------------------
+# MAIN
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Converts the text data of "
+                                     "a project into a memory mapped binary "
+                                     "dataset.")
+    parser.add_argument('kind', choices=sorted(PARSERS))
+    parser.add_argument('input')
+    parser.add_argument('output')
+    parser.add_argument('--labels',
+                        help="SVM: the labels of an unlabelled data file")
+    parser.add_argument('--dtype', choices=['float32', 'float64'],
+                        help="store the floating point columns in this type")
+    args = parser.parse_args()
+
+    convert(args.kind, args.input, args.output, args.labels, args.dtype)
@@ -0,0 +1,528 @@
+#!/usr/bin/env python
+
+import argparse
+import heapq
+import multiprocessing
+import os
+import shlex
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zlib
+
+#--------------------------------------------------------------------------
+# CONSTANTS
+
+SEPARATOR   = ', '          # Separates the key from the value of a record.
+SPLIT_SIZE  = 16 << 20      # Bytes of input per mapper task.
+SPILL_SIZE  = 64 << 20      # Bytes of mapper output buffered before a spill.
+MERGE_FANIN = 64            # Maximal number of runs merged at once.
+BUFFER_SIZE = 1 << 20       # Bytes per read or write when piping data.
+
+# Exported to the mappers with the number of reducers, as Hadoop streaming
+# does, for mappers whose output needs a single reducer.
+REDUCERS_VARIABLE = 'mapreduce_job_reduces'
+
+# Set to 1 for the combiner when it runs over a whole merged partition, so
+# that it may drop keys whose records cannot reach the reducer any more.
+PARTITION_VARIABLE = 'mapreduce_combine_partition'
+
+#--------------------------------------------------------------------------
+# INPUT SPLITS
+
+def splits(path, size):
+    """
+    Divides a file into byte ranges of about the specified size. Every
+    range ends at a line boundary, so no line is split.
+
+    @param path: The file to split.
+    @param size: The desired size of a range in bytes.
+
+    @return: A list of (path, start, end) tuples.
+    """
+    total  = os.path.getsize(path)
+    ranges = []
+    start  = 0
+
+    with open(path, 'rb') as inf:
+        while start < total:
+            inf.seek(min(start + size, total))
+            inf.readline()
+            end = min(inf.tell(), total)
+            ranges.append((path, start, end))
+            start = end
+
+    return ranges
+
+def read_range(path, start, end):
+    """
+    Reads the specified byte range of a file in blocks.
+    """
+    with open(path, 'rb') as inf:
+        inf.seek(start)
+        remaining = end - start
+        while remaining > 0:
+            block = inf.read(min(BUFFER_SIZE, remaining))
+            if not block:
+                break
+            remaining -= len(block)
+            yield block
+
+#--------------------------------------------------------------------------
+# RECORDS
+
+def key_of(line, separator):
+    """
+    Returns the key of a record, which is everything before the first
+    separator, or the whole line if there is none.
+    """
+    index = line.find(separator)
+    if index < 0:
+        return line.rstrip('\n')
+
+    return line[:index]
+
+def partition_of(key, partitions):
+    """
+    Returns the partition a key belongs to. The partition is stable across
+    processes and runs, unlike the builtin hash.
+    """
+    return (zlib.crc32(key) & 0xffffffff) % partitions
+
+def read_run(path, separator):
+    """
+    Reads a sorted run as (key, line) tuples.
+    """
+    with open(path, 'rb') as inf:
+        for line in inf:
+            yield (key_of(line, separator), line)
+
+def merge(paths, output, separator, fanin=MERGE_FANIN):
+    """
+    Merges sorted runs into a single sorted file. At most fanin runs are
+    opened at once, larger sets of runs are merged in several passes. Every
+    pass writes runs of its own names and removes the runs of the previous
+    pass once they are merged, the given runs are kept.
+
+    @param paths:     The paths of the sorted runs.
+    @param output:    The path of the merged file.
+    @param separator: The separator of keys and values.
+    @param fanin:     The maximal number of runs merged at once.
+    """
+    paths = list(paths)
+    level = 0
+    while len(paths) > fanin:
+        merged = []
+        for start in xrange(0, len(paths), fanin):
+            group = paths[start:start + fanin]
+            name  = '%s.p%d.%d' % (output, level, len(merged))
+            merge_runs(group, name, separator)
+            merged.append(name)
+            if level > 0:
+                for path in group:
+                    os.remove(path)
+        paths = merged
+        level += 1
+
+    merge_runs(paths, output, separator)
+    if level > 0:
+        for path in paths:
+            os.remove(path)
+
+def merge_runs(paths, output, separator):
+    """
+    Merges sorted runs into a single sorted file in one pass.
+    """
+    with open(output, 'wb') as outf:
+        runs = [read_run(path, separator) for path in paths]
+        for key, line in heapq.merge(*runs):
+            outf.write(line)
+
+def check_merge(runs=5, records=10, fanin=2):
+    """
+    Merges runs of distinct records with a small fan-in, which takes
+    several passes, and checks that all records come out sorted.
+    """
+    tmpdir = tempfile.mkdtemp(prefix='mapreduce-check-')
+    try:
+        paths = []
+        for run in xrange(runs):
+            path = os.path.join(tmpdir, 'run-%d' % run)
+            with open(path, 'wb') as outf:
+                for record in xrange(records):
+                    outf.write('k%04d%s%d\n' % (record*runs + run,
+                                                  SEPARATOR, run))
+            paths.append(path)
+
+        output = os.path.join(tmpdir, 'merged')
+        merge(paths, output, SEPARATOR, fanin)
+
+        with open(output, 'rb') as inf:
+            keys = [key_of(line, SEPARATOR) for line in inf]
+        expected = ['k%04d' % i for i in xrange(runs*records)]
+        if keys != expected:
+            raise AssertionError("Merged %d of %d records"
+                                 % (len(keys), len(expected)))
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+def combine(combiner, records, separator):
+    """
+    Runs a combiner on sorted records. The combined records are sorted
+    again, as a combiner is not required to keep the order of its keys.
+
+    @param combiner:  The command line of the combiner.
+    @param records:   A list of (key, line) tuples sorted by key.
+    @param separator: The separator of keys and values.
+
+    @return: The combined list of (key, line) tuples sorted by key.
+    """
+    process = subprocess.Popen(combiner, stdin=subprocess.PIPE,
+                               stdout=subprocess.PIPE, bufsize=BUFFER_SIZE)
+    feeder  = threading.Thread(target=feed, args=(
+        process, (line for key, line in records)))
+    feeder.start()
+
+    combined = [(key_of(line, separator), line.rstrip('\n') + '\n')
+                for line in iter(process.stdout.readline, '')]
+
+    feeder.join()
+    if process.wait() != 0:
+        raise RuntimeError("Combiner failed")
+
+    combined.sort(key=lambda record: record[0])
+
+    return combined
+
+class Spiller(object):
+    """
+    Buffers the output of a mapper by partition. Once SPILL_SIZE bytes
+    are buffered, every partition is sorted by key and written to disk as
+    a sorted run, which bounds the memory used per mapper. If a combiner
+    is given, every sorted partition is combined before it is written.
+    """
+
+    def __init__(self, name, partitions, separator, limit, tmpdir, combiner):
+        self.name       = name
+        self.separator  = separator
+        self.limit      = limit
+        self.tmpdir     = tmpdir
+        self.combiner   = combiner
+        self.buffers    = [[] for _ in xrange(partitions)]
+        self.runs       = [[] for _ in xrange(partitions)]
+        self.size       = 0
+        self.records    = 0
+        self.spilled    = 0
+        self.written    = 0
+
+    def add(self, line):
+        if not line.endswith('\n'):
+            line += '\n'
+
+        key = key_of(line, self.separator)
+        self.buffers[partition_of(key, len(self.buffers))].append((key, line))
+        self.size    += len(line)
+        self.records += 1
+
+        if self.size >= self.limit:
+            self.spill()
+
+    def spill(self):
+        for part, records in enumerate(self.buffers):
+            if len(records) == 0:
+                continue
+
+            records.sort(key=lambda record: record[0])
+            self.spilled += sum(len(line) for key, line in records)
+
+            if self.combiner:
+                records = combine(self.combiner, records, self.separator)
+
+            path = os.path.join(self.tmpdir, 'run-%s-%d-%d' % (
+                self.name, part, len(self.runs[part])))
+
+            with open(path, 'wb') as outf:
+                for key, line in records:
+                    outf.write(line)
+
+            self.written += os.path.getsize(path)
+            self.runs[part].append(path)
+            self.buffers[part] = []
+
+        self.size = 0
+
+#--------------------------------------------------------------------------
+# TASKS
+
+def command(interpreter, script, arguments):
+    """
+    Returns the command line running a script with its arguments.
+    """
+    return [interpreter, script] + shlex.split(arguments or '')
+
+def feed(process, blocks):
+    """
+    Writes the blocks to the standard input of a process and closes it.
+    Runs in its own thread, such that the output can be consumed at the
+    same time.
+    """
+    try:
+        for block in blocks:
+            process.stdin.write(block)
+    except IOError:
+        pass
+    finally:
+        process.stdin.close()
+
+def map_task(task):
+    """
+    Runs a mapper on a split of the input and spills its sorted output.
+
+    @param task: A dictionary describing the task.
+
+    @return: A dictionary with the sorted runs per partition and statistics.
+    """
+    start   = time.time()
+    path, begin, end = task['split']
+    spiller = Spiller(task['name'], task['partitions'], task['separator'],
+                      task['spill_size'], task['tmpdir'], task['combiner'])
+
+    environment = dict(os.environ)
+    environment[REDUCERS_VARIABLE] = str(task['partitions'])
+    process = subprocess.Popen(task['mapper'], stdin=subprocess.PIPE,
+                               stdout=subprocess.PIPE, bufsize=BUFFER_SIZE,
+                               env=environment)
+    feeder  = threading.Thread(target=feed,
+                               args=(process, read_range(path, begin, end)))
+    feeder.start()
+
+    for line in iter(process.stdout.readline, ''):
+        spiller.add(line)
+
+    feeder.join()
+    if process.wait() != 0:
+        raise RuntimeError("Mapper failed on %s [%d, %d)" % (path, begin, end))
+
+    spiller.spill()
+
+    return {'runs':     spiller.runs,
+            'records':  spiller.records,
+            'input':    end - begin,
+            'mapped':   spiller.spilled,
+            'output':   spiller.written,
+            'seconds':  time.time() - start}
+
+def sort_file(path, output, separator, limit, tmpdir):
+    """
+    Sorts a file by key with bounded memory, by spilling sorted runs and
+    merging them.
+    """
+    name    = 'sort-' + os.path.basename(output)
+    spiller = Spiller(name, 1, separator, limit, tmpdir, None)
+
+    with open(path, 'rb') as inf:
+        for line in inf:
+            spiller.add(line)
+    spiller.spill()
+
+    merge(spiller.runs[0], output, separator)
+
+def merge_task(task):
+    """
+    Merges the sorted runs of a partition into a single sorted file. If a
+    combiner is given, the merged partition is combined once more, which
+    merges the records of all mappers before they reach the reducer. The
+    combiner finds PARTITION_VARIABLE set in its environment for this pass.
+    """
+    start  = time.time()
+    output = task['output']
+    merge(task['runs'], output, task['separator'])
+    merged = os.path.getsize(output)
+
+    if task['combiner']:
+        combined    = output + '.combined'
+        environment = dict(os.environ)
+        environment[PARTITION_VARIABLE] = '1'
+        with open(output, 'rb') as inf:
+            with open(combined, 'wb') as outf:
+                if subprocess.call(task['combiner'], stdin=inf, stdout=outf,
+                                   env=environment) != 0:
+                    raise RuntimeError("Combiner failed on %s" % output)
+
+        sort_file(combined, output, task['separator'], task['spill_size'],
+                  os.path.dirname(output))
+
+    return {'output':   output,
+            'merged':   merged,
+            'size':     os.path.getsize(output),
+            'seconds':  time.time() - start}
+
+def reduce_task(task):
+    """
+    Runs a reducer on a sorted partition.
+    """
+    start = time.time()
+
+    with open(task['output'], 'wb') as outf:
+        process = subprocess.Popen(task['reducer'], stdin=subprocess.PIPE,
+                                   stdout=outf, bufsize=BUFFER_SIZE)
+        feed(process, read_range(task['input'], 0,
+                                 os.path.getsize(task['input'])))
+
+        if process.wait() != 0:
+            raise RuntimeError("Reducer failed on %s" % task['input'])
+
+    return {'output':   task['output'],
+            'seconds':  time.time() - start}
+
+#--------------------------------------------------------------------------
+# JOBS
+
+def run(mapper, reducer, inputs, output,
+        mapper_args=None, reducer_args=None, combiner=None,
+        combiner_args=None, mappers=None, reducers=1,
+        split_size=SPLIT_SIZE, spill_size=SPILL_SIZE, separator=SEPARATOR,
+        interpreter=sys.executable, tmpdir=None, log=sys.stderr):
+    """
+    Runs a MapReduce job locally.
+
+    The inputs are split at line boundaries and the splits are mapped by
+    a pool of processes. The output of every mapper is partitioned by key,
+    sorted, optionally combined and spilled to disk in runs of bounded
+    size. The runs of every partition are merged, combined once more and
+    reduced in parallel, and the outputs of all partitions are concatenated
+    into the output file.
+
+    @param mapper:     The mapper script.
+    @param reducer:    The reducer script.
+    @param inputs:     A list of input files.
+    @param output:     The file to write the output of the reducers to.
+    @param combiner:   The combiner script, if any.
+    @param mappers:    The number of parallel processes (default: all cores).
+    @param reducers:   The number of reducer partitions.
+    @param split_size: The bytes of input per mapper task.
+    @param spill_size: The bytes of output a mapper buffers in memory.
+    @param separator:  The separator of keys and values.
+    @param log:        The stream to report timings to, or None.
+
+    @return: A dictionary with the statistics of all stages.
+    """
+    mappers = mappers or multiprocessing.cpu_count()
+    workdir = tempfile.mkdtemp(prefix='mapreduce-', dir=tmpdir)
+    stats   = {}
+
+    def report(stage, seconds, detail):
+        stats[stage] = dict(detail, seconds=seconds)
+        if log is not None:
+            log.write("%-8s %8.2fs  %s\n" % (stage, seconds, ', '.join(
+                "%s=%s" % (k, v) for k, v in sorted(detail.items()))))
+
+    pool = multiprocessing.Pool(processes=mappers)
+    try:
+        # MAPPING
+        start  = time.time()
+        ranges = [r for path in inputs for r in splits(path, split_size)]
+        tasks  = [{'name':       str(index),
+                   'split':      split,
+                   'mapper':     command(interpreter, mapper, mapper_args),
+                   'combiner':   combiner and command(interpreter, combiner,
+                                                      combiner_args),
+                   'partitions': reducers,
+                   'separator':  separator,
+                   'spill_size': spill_size,
+                   'tmpdir':     workdir}
+                  for index, split in enumerate(ranges)]
+        mapped = pool.map(map_task, tasks, chunksize=1)
+        report('map', time.time() - start, {
+            'splits':   len(tasks),
+            'records':  sum(m['records'] for m in mapped),
+            'input':    sum(m['input']   for m in mapped),
+            'mapped':   sum(m['mapped']  for m in mapped),
+            'output':   sum(m['output']  for m in mapped)})
+
+        # SHUFFLING
+        start  = time.time()
+        tasks  = [{'runs':       [run for m in mapped for run in m['runs'][part]],
+                   'output':     os.path.join(workdir, 'sorted-%d' % part),
+                   'combiner':   combiner and command(interpreter, combiner,
+                                                      combiner_args),
+                   'spill_size': spill_size,
+                   'separator':  separator}
+                  for part in xrange(reducers)]
+        merged = pool.map(merge_task, tasks, chunksize=1)
+        report('shuffle', time.time() - start, {
+            'partitions': reducers,
+            'runs':       sum(len(t['runs']) for t in tasks),
+            'merged':     sum(m['merged'] for m in merged),
+            'output':     sum(m['size']   for m in merged)})
+
+        # REDUCING
+        start   = time.time()
+        tasks   = [{'input':   m['output'],
+                    'output':  os.path.join(workdir, 'part-%d' % part),
+                    'reducer': command(interpreter, reducer, reducer_args)}
+                   for part, m in enumerate(merged)]
+        reduced = pool.map(reduce_task, tasks, chunksize=1)
+
+        with open(output, 'wb') as outf:
+            for r in reduced:
+                with open(r['output'], 'rb') as inf:
+                    shutil.copyfileobj(inf, outf, BUFFER_SIZE)
+
+        report('reduce', time.time() - start, {
+            'output': os.path.getsize(output)})
+    finally:
+        pool.terminate()
+        pool.join()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return stats
+
+#--------------------------------------------------------------------------
+# MAIN
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Runs a MapReduce job "
+                                     "on the local machine.")
+    parser.add_argument('--mapper')
+    parser.add_argument('--reducer')
+    parser.add_argument('--input',        nargs='+')
+    parser.add_argument('--output')
+    parser.add_argument('--mapper-args',  default='')
+    parser.add_argument('--reducer-args', default='')
+    parser.add_argument('--combiner',     default=None)
+    parser.add_argument('--combiner-args', default='')
+    parser.add_argument('--mappers',      type=int, default=None,
+                        help="parallel processes (default: all cores)")
+    parser.add_argument('--reducers',     type=int, default=1,
+                        help="reducer partitions (default: 1)")
+    parser.add_argument('--split-size',   type=int, default=SPLIT_SIZE)
+    parser.add_argument('--spill-size',   type=int, default=SPILL_SIZE)
+    parser.add_argument('--separator',    default=SEPARATOR)
+    parser.add_argument('--interpreter',  default=sys.executable)
+    parser.add_argument('--tmpdir',       default=None)
+    parser.add_argument('--check',        action='store_true',
+                        help="check the multi-pass merge and exit")
+    args = parser.parse_args()
+
+    if args.check:
+        check_merge()
+        sys.stderr.write("merge ok\n")
+        sys.exit(0)
+
+    if not (args.mapper and args.reducer and args.input and args.output):
+        parser.error("--mapper, --reducer, --input and --output are required")
+
+    stats = run(args.mapper, args.reducer, args.input, args.output,
+                mapper_args=args.mapper_args, reducer_args=args.reducer_args,
+                combiner=args.combiner, combiner_args=args.combiner_args,
+                mappers=args.mappers, reducers=args.reducers,
+                split_size=args.split_size, spill_size=args.spill_size,
+                separator=args.separator, interpreter=args.interpreter,
+                tmpdir=args.tmpdir)
+
+    total = sum(stage['seconds'] for stage in stats.values())
+    sys.stderr.write("%-8s %8.2fs\n" % ('total', total))
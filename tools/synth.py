@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+
+import argparse
+import numpy as np
+import os
+
+#--------------------------------------------------------------------------
+# CONSTANTS
+
+SHINGLES        = 20000     # Shingles are drawn from [0, SHINGLES).
+VIDEO_SHINGLES  = (50, 400) # Range of shingles per video.
+DUPLICATE_RATE  = 0.05      # Fraction of videos that are near duplicates.
+MUTATION_RATE   = 0.03      # Fraction of shingles replaced in a duplicate.
+
+SVM_FEATURES    = 400
+KMEANS_FEATURES = 500
+KMEANS_CLUSTERS = 100
+USER_FEATURES   = 6
+ARTICLE_CHOICES = 20
+
+#--------------------------------------------------------------------------
+# LSH
+
+def jaccard(shin1, shin2):
+    shin1 = set(shin1)
+    shin2 = set(shin2)
+    return len(shin1 & shin2)/float(len(shin1 | shin2))
+
+def videos(path, count, seed=42, threshold=0.9):
+    """
+    Generates shingled videos in the format of the LSH training data, with
+    near duplicates planted by copying videos and replacing a few of their
+    shingles. The planted pairs with a Jaccard similarity of at least the
+    threshold are written to <path>.duplicates.
+
+    @param path:  The file to write the videos to.
+    @param count: The number of videos.
+    @param seed:  The seed of the generator.
+    """
+    rng      = np.random.RandomState(seed)
+    shingles = []
+    family   = {}
+    members  = {}
+
+    for vid in xrange(count):
+        if vid > 0 and rng.rand() < DUPLICATE_RATE:
+            origin = rng.randint(0, vid)
+            shin   = shingles[origin].copy()
+            mutate = rng.rand(len(shin)) < MUTATION_RATE
+            shin[mutate] = rng.randint(0, SHINGLES, size=mutate.sum())
+            family[vid] = family.get(origin, origin)
+            members.setdefault(family[vid], [family[vid]]).append(vid)
+        else:
+            shin = rng.randint(0, SHINGLES, size=rng.randint(*VIDEO_SHINGLES))
+
+        shingles.append(shin)
+
+    with open(path, 'w') as outf:
+        for vid, shin in enumerate(shingles):
+            outf.write("VIDEO_%09d %s\n" % (vid, ' '.join(str(s) for s in shin)))
+
+    # Duplicates of duplicates are similar among each other as well, so
+    # all pairs within a family of copies are checked.
+    with open(path + '.duplicates', 'w') as outf:
+        for root, copies in sorted(members.items()):
+            for i, vid1 in enumerate(copies):
+                for vid2 in copies[i + 1:]:
+                    if jaccard(shingles[vid1], shingles[vid2]) >= threshold:
+                        outf.write("%d\t%d\n" % (vid1, vid2))
+
+#--------------------------------------------------------------------------
+# SVM
+
+def svm(path, count, seed=42, features=SVM_FEATURES):
+    """
+    Generates labelled data in the format of the SVM training data. The
+    features are small non-negative frequencies and the labels are given
+    by a random hyperplane with some label noise. The unlabelled data and
+    the labels are also written to <path>.data and <path>.labels, as read
+    by the evaluator.
+
+    @param path:  The file to write the labelled data to.
+    @param count: The number of samples.
+    @param seed:  The seed of the generator.
+    """
+    rng     = np.random.RandomState(seed)
+    data    = rng.exponential(0.002, size=(count, features))
+    weights = rng.randn(features)
+    scores  = (data - 0.002).dot(weights)
+    labels  = np.where(scores >= 0, 1, -1)
+    labels[rng.rand(count) < 0.05] *= -1
+
+    with open(path, 'w') as outf, open(path + '.data', 'w') as dataf, \
+         open(path + '.labels', 'w') as labelf:
+        for label, row in zip(labels, data):
+            string = ' '.join('%.8f' % x for x in row)
+            outf.write("%d %s\n" % (label, string))
+            dataf.write("%s\n" % string)
+            labelf.write("%d\n" % label)
+
+#--------------------------------------------------------------------------
+# K-MEANS
+
+def kmeans(path, count, seed=42, features=KMEANS_FEATURES,
+           clusters=KMEANS_CLUSTERS):
+    """
+    Generates points drawn from gaussian clusters of different sizes.
+
+    @param path:  The file to write the points to.
+    @param count: The number of points.
+    @param seed:  The seed of the generator.
+    """
+    rng     = np.random.RandomState(seed)
+    centers = rng.uniform(-1.0, 1.0, size=(clusters, features))
+    sizes   = rng.dirichlet(np.ones(clusters))
+    labels  = rng.choice(clusters, size=count, p=sizes)
+
+    with open(path, 'w') as outf:
+        for start in xrange(0, count, 1024):
+            block  = labels[start:start + 1024]
+            points = centers[block] + 0.1*rng.randn(len(block), features)
+            np.savetxt(outf, points, fmt='%.6f')
+
+#--------------------------------------------------------------------------
+# BANDITS
+
+def bandit(path, count, seed=42, articles=100):
+    """
+    Generates a click log in the format of the bandit evaluator. Every line
+    holds a timestamp, the user features, the displayed article, the click
+    and the articles available. The article features are written to
+    <path>.articles.
+
+    @param path:     The file to write the log to.
+    @param count:    The number of log lines.
+    @param seed:     The seed of the generator.
+    @param articles: The number of distinct articles.
+    """
+    rng      = np.random.RandomState(seed)
+    ids      = np.arange(100000, 100000 + articles)
+    features = rng.dirichlet(np.ones(USER_FEATURES), size=articles)
+
+    with open(path + '.articles', 'w') as outf:
+        for aid, feat in zip(ids, features):
+            outf.write("%d %s\n" % (aid, ' '.join('%.6f' % f for f in feat)))
+
+    with open(path, 'w') as outf:
+        for line in xrange(count):
+            user    = rng.dirichlet(np.ones(USER_FEATURES))
+            choices = rng.choice(articles, size=ARTICLE_CHOICES, replace=False)
+            shown   = rng.choice(choices)
+            click   = int(rng.rand() < 0.1*user.dot(features[shown])*USER_FEATURES)
+
+            outf.write("%d %s %d %d %s\n" % (
+                1317513291 + line, ' '.join('%.6f' % u for u in user),
+                ids[shown], click, ' '.join(str(ids[c]) for c in choices)))
+
+#--------------------------------------------------------------------------
+# MAIN
+
+GENERATORS = {'lsh': videos, 'svm': svm, 'kmeans': kmeans, 'bandit': bandit}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generates synthetic data "
+                                     "for the pipelines of all projects.")
+    parser.add_argument('kind', choices=sorted(GENERATORS))
+    parser.add_argument('output')
+    parser.add_argument('--count', type=int, default=1000)
+    parser.add_argument('--seed',  type=int, default=42)
+    args = parser.parse_args()
+
+    GENERATORS[args.kind](args.output, args.count, seed=args.seed)
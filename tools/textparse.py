@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+
+import numpy as np
+
+#--------------------------------------------------------------------------
+# CONSTANTS
+#
+# The parsers read a stream in large blocks and parse a whole chunk of
+# lines with a single np.fromstring call. Rows of varying length (the LSH
+# shingles, the bandit articles) are parsed in one call as well, by ending
+# every line with the SENTINEL, which none of the formats contains.
+
+BLOCK_BYTES = 1 << 22       # Bytes read from the stream at once.
+CHUNK_ROWS  = 4096          # Default number of rows per chunk.
+SENTINEL    = -1            # Marks the end of a row of varying length.
+
+VIDEO_PREFIX = 'VIDEO_'     # Prefix of the LSH video ids.
+USER_FEATURES = 6           # Features per user in the bandit log.
+
+#--------------------------------------------------------------------------
+# LINES
+
+def lines(stream, rows=CHUNK_ROWS):
+    """
+    Reads the non empty lines of a stream in chunks.
+
+    @param stream: The stream to read.
+    @param rows:   The number of lines per chunk. Only the last chunk may
+                   hold less.
+
+    @return: A generator of lists of lines.
+    """
+    pending = []
+    rest    = ''
+
+    while True:
+        data = stream.read(BLOCK_BYTES)
+        if not data:
+            break
+
+        parts = (rest + data).split('\n')
+        rest  = parts.pop()
+        pending.extend(part for part in parts if part.strip())
+
+        start = 0
+        while len(pending) - start >= rows:
+            yield pending[start:start + rows]
+            start += rows
+        pending = pending[start:]
+
+    if rest.strip():
+        pending.append(rest)
+
+    for start in xrange(0, len(pending), rows):
+        yield pending[start:start + rows]
+
+#--------------------------------------------------------------------------
+# PARSERS
+
+def parse_dense(chunk, dtype=np.float64):
+    """
+    Parses a chunk of lines of equally many numbers into a matrix.
+    """
+    values = np.fromstring(' '.join(chunk), sep=' ', dtype=dtype)
+    if values.size % len(chunk) != 0:
+        raise ValueError("The rows have different lengths")
+
+    return values.reshape(len(chunk), -1)
+
+def parse_ragged(chunk, dtype=np.float64):
+    """
+    Parses a chunk of lines of varying length.
+
+    @return: A (values, offsets) tuple, where the values of the i-th line
+             are values[offsets[i]:offsets[i + 1]].
+    """
+    end     = ' %d' % SENTINEL
+    values  = np.fromstring((end + ' ').join(chunk) + end, sep=' ',
+                            dtype=dtype)
+    ends    = np.flatnonzero(values == SENTINEL)
+    lengths = np.diff(np.concatenate([[-1], ends])) - 1
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+
+    return (values[values != SENTINEL], offsets)
+
+def split_prefix(values, offsets, count):
+    """
+    Splits the first count values off every row of a ragged chunk.
+
+    @return: A (prefix, values, offsets) tuple, where prefix is a matrix
+             holding the first count values of each row, and values and
+             offsets describe the remainder of the rows.
+    """
+    starts  = offsets[:-1]
+    prefix  = values[starts[:, np.newaxis] + np.arange(count)]
+    keep    = np.ones(len(values), dtype=bool)
+    keep[(starts[:, np.newaxis] + np.arange(count)).ravel()] = False
+    offsets = offsets - count*np.arange(len(offsets))
+
+    return (prefix, values[keep], offsets)
+
+#--------------------------------------------------------------------------
+# FORMATS
+
+def dense(stream, rows=CHUNK_ROWS, dtype=np.float64):
+    """
+    Reads whitespace separated rows of numbers, e.g. the k-means points.
+
+    @return: A generator of matrices of at most rows rows.
+    """
+    for chunk in lines(stream, rows):
+        yield parse_dense(chunk, dtype)
+
+def labelled(stream, rows=CHUNK_ROWS):
+    """
+    Reads '<label> <features>' rows, e.g. the SVM training data.
+
+    @return: A generator of (labels, features) tuples.
+    """
+    for data in dense(stream, rows):
+        yield (data[:, 0].astype(int), data[:, 1:])
+
+def videos(stream, rows=CHUNK_ROWS):
+    """
+    Reads 'VIDEO_<id> <shingles>' rows, the LSH training data. The ids
+    have nine digits, so they are parsed as int32 like the shingles.
+
+    @return: A generator of (video ids, shingles, offsets) tuples, where
+             the shingles of the i-th video are shingles[offsets[i]:
+             offsets[i + 1]].
+    """
+    for chunk in lines(stream, rows):
+        chunk = [line.replace(VIDEO_PREFIX, '', 1) for line in chunk]
+        values, offsets = parse_ragged(chunk, np.int32)
+        vids, shingles, offsets = split_prefix(values, offsets, 1)
+        yield (vids[:, 0].astype(np.int64), shingles, offsets)
+
+def bandit(stream, rows=CHUNK_ROWS):
+    """
+    Reads the rows of the bandit log: '<time> <user features> <chosen>
+    <reward> <articles>', with a varying number of articles.
+
+    @return: A generator of (times, user features, chosen, rewards,
+             articles, offsets) tuples, where the articles of the i-th row
+             are articles[offsets[i]:offsets[i + 1]].
+    """
+    head = 1 + USER_FEATURES + 2
+    for chunk in lines(stream, rows):
+        values, offsets = parse_ragged(chunk, np.float64)
+        prefix, articles, offsets = split_prefix(values, offsets, head)
+        yield (prefix[:, 0].astype(np.int64),
+               prefix[:, 1:1 + USER_FEATURES],
+               prefix[:, head - 2].astype(np.int64),
+               prefix[:, head - 1].astype(np.int64),
+               articles.astype(np.int64), offsets)